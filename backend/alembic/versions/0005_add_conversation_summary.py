@@ -0,0 +1,29 @@
+"""add rolling summary to conversations
+
+Revision ID: 0005_add_conversation_summary
+Revises: 0004_add_accounts_auth
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_add_conversation_summary"
+down_revision = "0004_add_accounts_auth"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {col["name"] for col in inspector.get_columns("conversations")} if inspector.has_table("conversations") else set()
+    if "summary" not in columns:
+        op.add_column("conversations", sa.Column("summary", sa.Text(), nullable=True))
+    if "summary_message_id" not in columns:
+        op.add_column("conversations", sa.Column("summary_message_id", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("conversations", "summary_message_id")
+    op.drop_column("conversations", "summary")
@@ -1,12 +1,22 @@
+import asyncio
 import json
 import re
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
 
-from langdetect import detect
+from openai import BadRequestError
 
-from app.ai.provider import get_llm_client
-from app.ai.rag import retrieve_context
+from app.ai.context import estimate_tokens, fit_history, message_tokens, prompt_budget, record_prompt_usage
+from app.ai.language import conversation_language, language_stats
+from app.ai.provider import create_completion, get_llm_client, json_mode_available, json_mode_unsupported
+from app.ai.rag import pack_knowledge_context
+from app.ai.response_cache import ResponseCache, get_response_cache, prompt_fingerprint
 from app.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger()
 
 BASE_SYSTEM_PROMPT = (
     "You are a business chatbot for lead collection. "
@@ -22,47 +32,277 @@ EXTRACT_PROMPT = (
     "Use null for missing fields."
 )
 
+STRUCTURED_PROMPT = (
+    "Return ONLY a valid JSON object with two keys: "
+    '"reply", your message to the user, and '
+    '"lead", an object with keys name, phone, email, intent extracted from the user\'s latest message. '
+    "Use null for missing lead fields."
+)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a customer conversation for a business chatbot. "
+    "Merge the new messages into the current summary. Keep the customer's goals, questions, "
+    "preferences, contact details and anything already promised. Use at most {words} words."
+)
+
+_LEAD_HINT = re.compile(
+    r"\b(?:name|intent)\s*[:=]|\bmy name\b|\bcall me\b|\breach me\b|\bcontact me\b",
+    re.IGNORECASE,
+)
+
+_path_lock = threading.Lock()
+_path_stats: Dict[str, Dict[str, float]] = {}
+_ttft_ms: Deque[float] = deque(maxlen=1000)
+
+
+def _build_messages(
+    message: str,
+    channel: str,
+    history: List[Dict[str, str]],
+    tenant_id: Optional[str],
+    structured: bool,
+    summary: Optional[str] = None,
+    conversation_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, str]], str]:
+    language_key = (tenant_id or settings.default_tenant_id, conversation_id) if conversation_id is not None else None
+    language = conversation_language(language_key, message)
+    system_prompt = _build_system_prompt()
+    language_note = [{"role": "system", "content": f"Respond in {language}."}] if language != "en" else []
+    format_note = [{"role": "system", "content": STRUCTURED_PROMPT}] if structured else []
+    summary_note = [{"role": "system", "content": f"Conversation so far: {summary}"}] if summary else []
+    user_turn = {"role": "user", "content": message}
+    fixed = [
+        {"role": "system", "content": system_prompt},
+        *format_note,
+        {"role": "system", "content": f"Channel: {channel}. Context: "},
+        *language_note,
+        *summary_note,
+        user_turn,
+    ]
+    remaining = prompt_budget(settings.ai_model) - message_tokens(fixed)
+    packed = pack_knowledge_context(message, max(min(settings.rag_context_tokens, remaining), 0), tenant_id)
+    context = packed.text
+    history = fit_history(history, remaining - packed.tokens)
+    usage = {
+        "system": message_tokens(fixed[:-1]) - message_tokens(summary_note),
+        "summary": message_tokens(summary_note),
+        "context": packed.tokens,
+        "history": message_tokens(history),
+        "message": message_tokens([user_turn]),
+    }
+    record_prompt_usage(usage)
+    logger.debug("Prompt tokens: %s (%s chunks packed, %s dropped)", usage, packed.chunks, packed.dropped)
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *format_note,
+        {"role": "system", "content": f"Channel: {channel}. Context: {context}"},
+        *language_note,
+        *summary_note,
+        *history,
+        user_turn,
+    ]
+    return messages, context
+
+
 async def generate_reply(
     message: str,
     channel: str,
     history: List[Dict[str, str]],
+    tenant_id: Optional[str] = None,
+    with_lead: bool = True,
+    summary: Optional[str] = None,
+    conversation_id: Optional[int] = None,
 ) -> Tuple[str, Optional[Dict[str, Optional[str]]]]:
-    context = retrieve_context(message)
-    language = _detect_language(message)
-    system_prompt = _build_system_prompt()
+    structured = bool(settings.ai_api_key) and _use_structured()
+    messages, context = await asyncio.to_thread(
+        _build_messages, message, channel, history, tenant_id, structured, summary, conversation_id
+    )
 
     if settings.ai_api_key:
-        client, model = get_llm_client()
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "system", "content": f"Channel: {channel}. Context: {context}"},
-        ]
-        if language != "en":
-            messages.append({"role": "system", "content": f"Respond in {language}."})
-        messages.extend(history)
-        messages.append({"role": "user", "content": message})
-
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-        )
-        reply = response.choices[0].message.content or ""
+        started = time.perf_counter()
+        cache, scope = _cache_scope(message, settings.ai_model, messages, tenant_id)
+        cached = cache.get(tenant_id or settings.default_tenant_id, scope, message) if scope else None
+        if cached is not None:
+            _record_path("cache", started)
+            return cached, None
+        path = "two_call"
+        result = await _structured_reply(messages) if structured else None
+        if result is not None:
+            path = "structured"
+            # An empty lead means extraction already ran and found nothing; None means it never ran.
+            reply, lead = result[0], result[1] or {}
+        else:
+            if structured:
+                path = "fallback"
+                messages = [item for item in messages if item["content"] != STRUCTURED_PROMPT]
+            reply = await _completion(messages)
+            lead = (await _extract_lead(message) or {}) if with_lead and might_contain_lead(message) else None
+        _record_path(path, started)
+        if scope:
+            cache.put(scope, message, reply)
+    else:
+        reply = f"Echo from {channel}: {message}\nContext: {context}"
+        lead = _heuristic_lead(message) if with_lead else None
+
+    return reply, lead
+
 
-        extract = await client.chat.completions.create(
-            model=model,
+async def stream_reply(
+    message: str,
+    channel: str,
+    history: List[Dict[str, str]],
+    tenant_id: Optional[str] = None,
+    summary: Optional[str] = None,
+    conversation_id: Optional[int] = None,
+) -> AsyncIterator[str]:
+    messages, context = await asyncio.to_thread(
+        _build_messages, message, channel, history, tenant_id, False, summary, conversation_id
+    )
+    if not settings.ai_api_key:
+        yield f"Echo from {channel}: {message}\nContext: {context}"
+        return
+
+    client, model = get_llm_client()
+    cache, scope = _cache_scope(message, settings.ai_model, messages, tenant_id)
+    cached = cache.get(tenant_id or settings.default_tenant_id, scope, message) if scope else None
+    if cached is not None:
+        yield cached
+        return
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True)
+    parts: List[str] = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    if scope:
+        cache.put(scope, message, "".join(parts))
+
+
+async def summarize_conversation(summary: Optional[str], messages: List[Dict[str, str]]) -> str:
+    transcript = "\n".join(f"{item['role']}: {item['content']}" for item in messages)
+    if settings.ai_api_key:
+        response = await create_completion(
             messages=[
-                {"role": "system", "content": EXTRACT_PROMPT},
-                {"role": "user", "content": message},
+                {"role": "system", "content": SUMMARY_PROMPT.format(words=settings.ai_summary_tokens * 3 // 4)},
+                {"role": "user", "content": f"Current summary: {summary or '(none)'}\n\nNew messages:\n{transcript}"},
             ],
+            max_tokens=settings.ai_summary_tokens,
         )
-        raw = extract.choices[0].message.content or "{}"
-        lead = _safe_json(raw)
-        lead = _normalize_lead(lead)
-    else:
-        reply = f"Echo from {channel}: {message}\nContext: {context}"
-        lead = _heuristic_lead(message)
+        return (response.choices[0].message.content or summary or "").strip()
+    # Without a model, keep the most recent lines that fit the summary budget.
+    lines = [line for line in f"{summary or ''}\n{transcript}".splitlines() if line.strip()]
+    kept: List[str] = []
+    for line in reversed(lines):
+        if estimate_tokens("\n".join([line, *kept])) > settings.ai_summary_tokens:
+            break
+        kept.insert(0, line)
+    return "\n".join(kept)
+
+
+def might_contain_lead(message: str) -> bool:
+    return bool(_LEAD_HINT.search(message) or _match_phone(message) or _match_email(message))
+
+
+async def extract_lead(message: str) -> Optional[Dict[str, Optional[str]]]:
+    if not might_contain_lead(message):
+        return None
+    if not settings.ai_api_key:
+        return _heuristic_lead(message)
+    return await _extract_lead(message)
+
+
+def _cache_scope(
+    message: str, model: str, messages: List[Dict[str, str]], tenant_id: Optional[str]
+) -> Tuple[ResponseCache, Optional[str]]:
+    cache = get_response_cache()
+    # Replies to messages carrying contact details are personal and never shared.
+    if cache.capacity <= 0 or might_contain_lead(message):
+        return cache, None
+    prompt = [item for item in messages if item["content"] != STRUCTURED_PROMPT]
+    return cache, f"{tenant_id or settings.default_tenant_id}:{prompt_fingerprint(model, prompt)}"
+
+
+def _use_structured() -> bool:
+    return settings.ai_reply_mode == "structured" and json_mode_available()
+
+
+async def _completion(messages: List[Dict[str, str]]) -> str:
+    response = await create_completion(messages=messages)
+    return response.choices[0].message.content or ""
+
+
+async def _extract_lead(message: str) -> Optional[Dict[str, Optional[str]]]:
+    raw = await _completion(
+        [
+            {"role": "system", "content": EXTRACT_PROMPT},
+            {"role": "user", "content": message},
+        ],
+    )
+    return _normalize_lead(_safe_json(raw or "{}"))
+
+
+async def _structured_reply(
+    messages: List[Dict[str, str]],
+) -> Optional[Tuple[str, Optional[Dict[str, Optional[str]]]]]:
+    try:
+        response = await create_completion(
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+    except BadRequestError as exc:
+        # The pool remembers which endpoints reject JSON mode; this turn just falls back.
+        logger.warning("Structured reply was rejected (%s); using two calls", exc)
+        return None
+    data = _safe_json(response.choices[0].message.content or "")
+    reply = data.get("reply") if isinstance(data, dict) else None
+    if not isinstance(reply, str) or not reply.strip():
+        logger.warning("Structured reply from %s was not valid JSON; using two calls", settings.ai_model)
+        return None
+    lead = data.get("lead")
+    return reply.strip(), _normalize_lead(lead if isinstance(lead, dict) else {})
+
+
+def _record_path(path: str, started: float) -> None:
+    elapsed = (time.perf_counter() - started) * 1000
+    with _path_lock:
+        stats = _path_stats.setdefault(path, {"calls": 0, "total_ms": 0.0})
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed
 
-    return reply, lead
+
+def record_stream(started: float, first_token: Optional[float]) -> None:
+    _record_path("stream", started)
+    if first_token is not None:
+        with _path_lock:
+            _ttft_ms.append((first_token - started) * 1000)
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    return round(values[min(int(len(values) * fraction), len(values) - 1)], 1)
+
+
+def reply_path_stats() -> Dict[str, Any]:
+    with _path_lock:
+        paths = {
+            path: {"calls": int(stats["calls"]), "avg_ms": round(stats["total_ms"] / stats["calls"], 1)}
+            for path, stats in _path_stats.items()
+        }
+        ttft = sorted(_ttft_ms)
+    return {
+        "mode": settings.ai_reply_mode,
+        "paths": paths,
+        "ttft_ms": {
+            "samples": len(ttft),
+            "avg": round(sum(ttft) / len(ttft), 1),
+            "p50": _percentile(ttft, 0.5),
+            "p95": _percentile(ttft, 0.95),
+        }
+        if ttft
+        else {"samples": 0},
+        "language": language_stats(),
+        "structured_unsupported": json_mode_unsupported(),
+    }
 
 
 def _build_system_prompt() -> str:
@@ -76,13 +316,6 @@ def _build_system_prompt() -> str:
     return prompt
 
 
-def _detect_language(message: str) -> str:
-    try:
-        return detect(message) or "en"
-    except Exception:
-        return "en"
-
-
 def _safe_json(raw: str) -> Dict[str, Optional[str]]:
     try:
         return json.loads(raw)
@@ -106,7 +339,7 @@ def _normalize_lead(data: Dict[str, Optional[str]]) -> Optional[Dict[str, Option
 def _clean_value(value: Optional[str]) -> Optional[str]:
     if not value:
         return None
-    value = value.strip()
+    value = str(value).strip()
     return value or None
 
 
@@ -0,0 +1,118 @@
+import re
+import threading
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from app.config import settings
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_usage_lock = threading.Lock()
+_usage_totals: Dict[str, int] = {}
+_usage_calls = 0
+
+
+class PackedContext(NamedTuple):
+    text: str
+    tokens: int
+    chunks: int
+    dropped: int
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return max((len(text) + 3) // 4, len(text.split()))
+
+
+def message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets: Dict[str, int] = {}
+    for item in raw.split(","):
+        model, _, value = item.partition("=")
+        if model.strip() and value.strip().isdigit():
+            budgets[model.strip()] = int(value)
+    return budgets
+
+
+def prompt_budget(model: str) -> int:
+    return _parse_budgets(settings.rag_prompt_budgets).get(model, settings.rag_prompt_tokens)
+
+
+def _sentences(text: str) -> List[str]:
+    sentences = [part.strip() for part in _SENTENCE_SPLIT.split(text.strip()) if part.strip()]
+    if len(sentences) > 1 and not re.match(r"[\"'(\[A-Z0-9]", sentences[0]):
+        sentences = sentences[1:]
+    if len(sentences) > 1 and not re.search(r"[.!?][\"')\]]?$", sentences[-1]):
+        sentences = sentences[:-1]
+    return sentences
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(re.findall(r"\w+", sentence.lower()))
+
+
+def pack_context(hits: Sequence[Tuple[str, float]], budget: int) -> PackedContext:
+    if not hits or budget <= 0:
+        return PackedContext("", 0, 0, len(hits))
+    top_score = max(score for _, score in hits) or 1.0
+    seen = set()
+    sections: List[str] = []
+    used = 0
+    dropped = 0
+    for text, score in hits:
+        if score / top_score < settings.rag_context_min_score_ratio or used >= budget:
+            dropped += 1
+            continue
+        kept: List[str] = []
+        for sentence in _sentences(text):
+            key = _sentence_key(sentence)
+            if not key or key in seen:
+                continue
+            cost = estimate_tokens(sentence)
+            if used + cost > budget:
+                break
+            seen.add(key)
+            kept.append(sentence)
+            used += cost
+        if kept:
+            sections.append(" ".join(kept))
+        else:
+            dropped += 1
+    text = "\n\n".join(sections)
+    return PackedContext(text, estimate_tokens(text), len(sections), dropped)
+
+
+def fit_history(history: Sequence[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(history):
+        cost = message_tokens([message])
+        if used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def record_prompt_usage(usage: Dict[str, int]) -> None:
+    global _usage_calls
+    with _usage_lock:
+        _usage_calls += 1
+        for section, tokens in usage.items():
+            _usage_totals[section] = _usage_totals.get(section, 0) + tokens
+
+
+def prompt_usage_stats() -> Dict[str, object]:
+    with _usage_lock:
+        calls = _usage_calls
+        totals = dict(_usage_totals)
+    return {
+        "calls": calls,
+        "total_tokens": totals,
+        "avg_tokens": {section: round(tokens / calls, 1) for section, tokens in totals.items()} if calls else {},
+    }
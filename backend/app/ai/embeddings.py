@@ -0,0 +1,71 @@
+import importlib
+import re
+import zlib
+from typing import Callable, Dict, Optional, Protocol, Sequence
+
+import numpy as np
+
+from app.config import settings
+
+
+class Embedder(Protocol):
+    key: str
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+        self.key = f"hashing{dim}"
+
+    def _features(self, text: str) -> Dict[int, float]:
+        features: Dict[int, float] = {}
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            grams = [word] if len(word) < 3 else [word] + [
+                f"#{word}#"[i : i + 3] for i in range(len(word))
+            ]
+            for position, gram in enumerate(grams):
+                digest = zlib.crc32(gram.encode("utf-8"))
+                weight = 1.0 if position == 0 else 0.5
+                bucket = digest % self.dim
+                features[bucket] = features.get(bucket, 0.0) + (weight if digest & 0x80000000 else -weight)
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, value in self._features(text).items():
+                matrix[row, bucket] = value
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+_FACTORIES: Dict[str, Callable[[int], Embedder]] = {"hashing": HashingEmbedder}
+_embedder: Optional[Embedder] = None
+_embedder_config: Optional[tuple] = None
+
+
+def register_embedder(name: str, factory: Callable[[int], Embedder]) -> None:
+    _FACTORIES[name] = factory
+
+
+def _resolve_factory(name: str) -> Callable[[int], Embedder]:
+    if name in _FACTORIES:
+        return _FACTORIES[name]
+    if ":" in name:
+        module_name, attr = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), attr)
+    raise RuntimeError(f"Unsupported RAG_EMBEDDER: {name}")
+
+
+def get_embedder() -> Embedder:
+    global _embedder, _embedder_config
+    config = (settings.rag_embedder, settings.rag_embedding_dim)
+    if _embedder is None or _embedder_config != config:
+        _embedder = _resolve_factory(settings.rag_embedder)(settings.rag_embedding_dim)
+        _embedder_config = config
+    return _embedder
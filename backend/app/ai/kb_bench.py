@@ -0,0 +1,242 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+CHUNKS_PER_DOCUMENT = 100
+STRIDE_SAMPLE_CHARS = 200_000
+VOCABULARY_SIZE = 5000
+RECALL_AT = (1, 4, 10)
+
+
+def _words(rng: np.random.Generator, count: int, length: int) -> List[str]:
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    return ["".join(row) for row in letters[rng.integers(0, 26, size=(count, length))]]
+
+
+def _filler(rng: np.random.Generator, vocabulary: List[str], weights: np.ndarray, size: int) -> str:
+    words = rng.choice(len(vocabulary), size=max(size // 7, 1), p=weights)
+    sentences = []
+    for start in range(0, len(words), 12):
+        sentence = " ".join(vocabulary[index] for index in words[start : start + 12])
+        sentences.append(sentence.capitalize() + ".")
+    return " ".join(sentences)[:size]
+
+
+def _chunk_stride(rng: np.random.Generator, vocabulary: List[str], weights: np.ndarray) -> float:
+    from app.ai.rag import _iter_chunks
+
+    # Measured from the real chunker so the requested sizes are the ones that run.
+    sample = _filler(rng, vocabulary, weights, STRIDE_SAMPLE_CHARS)
+    return len(sample) / max(sum(1 for _ in _iter_chunks([sample])), 1)
+
+
+def _corpus(
+    chunks: int, queries: int, seed: int
+) -> Tuple[int, Iterator[Tuple[str, str]], List[Tuple[str, str]]]:
+    rng = np.random.default_rng(seed)
+    vocabulary = _words(rng, VOCABULARY_SIZE, 6)
+    weights = 1.0 / np.arange(1, VOCABULARY_SIZE + 1)
+    weights /= weights.sum()
+    stride = _chunk_stride(np.random.default_rng(seed + 1), vocabulary, weights)
+    documents = max(chunks // CHUNKS_PER_DOCUMENT, 1)
+    size = int(max(chunks // documents, 1) * stride)
+    needles = _words(rng, queries * 3, 9)
+    placement = rng.integers(0, documents, size=queries)
+    facts: Dict[int, List[str]] = {}
+    judged = []
+    for query in range(queries):
+        subject, topic, answer = needles[query * 3 : query * 3 + 3]
+        sentence = f"The {subject} {topic} reference code is {answer}."
+        facts.setdefault(int(placement[query]), []).append(sentence)
+        judged.append((f"what is the {subject} {topic} reference code", sentence))
+
+    def texts() -> Iterator[Tuple[str, str]]:
+        # Generated one document at a time; callers stop once the target chunk count is stored.
+        document = 0
+        while True:
+            body = _filler(rng, vocabulary, weights, size)
+            for sentence in facts.get(document, []):
+                cut = body.find(". ", int(rng.integers(0, max(len(body) - 1, 1)))) + 2
+                body = body[:cut] + sentence + " " + body[cut:] if cut > 1 else body + " " + sentence
+            yield f"synthetic-{document:07d}.txt", body
+            document += 1
+
+    return documents, texts(), judged
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    return round(float(np.percentile(samples, percentile)) * 1000, 3) if samples else 0.0
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_size(chunks: int, queries: int, seed: int, workdir: Optional[str] = None) -> dict:
+    from app.config import settings
+
+    root = tempfile.mkdtemp(prefix=f"kb-bench-{chunks}-", dir=workdir)
+    settings.kb_path = root
+    from app.ai import rag
+
+    # Peak RSS is reported above this, so it reflects retrieval rather than the interpreter.
+    baseline_rss = _peak_rss_mb()
+    try:
+        planned, texts, judged = _corpus(chunks, queries, seed)
+        ingested_bytes = 0
+        written = 0
+        documents = 0
+        started = time.perf_counter()
+        for filename, body in texts:
+            if documents >= planned and written >= chunks:
+                break
+            path = os.path.join(root, filename)
+            with open(path, "w", encoding="utf-8") as handle:
+                handle.write(body)
+            written += rag.ingest_document(filename, path)["chunks"]
+            ingested_bytes += len(body.encode("utf-8"))
+            documents += 1
+            os.remove(path)
+        ingest_seconds = time.perf_counter() - started
+        stored_chunks = sum(doc["chunks"] for doc in rag.list_documents())
+
+        depth = max(RECALL_AT)
+        latencies: List[float] = []
+        found = {k: 0 for k in RECALL_AT}
+        for query, needle in judged:
+            started = time.perf_counter()
+            hits = rag.search_knowledge_base_hits(query, depth)
+            latencies.append(time.perf_counter() - started)
+            rank = next((position for position, (text, _) in enumerate(hits) if needle in text), None)
+            for k in RECALL_AT:
+                found[k] += rank is not None and rank < k
+        return {
+            "target_chunks": chunks,
+            "chunks": stored_chunks,
+            "documents": documents,
+            "ingest": {
+                "seconds": round(ingest_seconds, 3),
+                "chunks_per_second": round(stored_chunks / ingest_seconds, 1) if ingest_seconds else 0.0,
+                "mb_per_second": round(ingested_bytes / 1048576 / ingest_seconds, 3) if ingest_seconds else 0.0,
+            },
+            "query": {
+                "count": len(latencies),
+                "mean_ms": round(float(np.mean(latencies)) * 1000, 3) if latencies else 0.0,
+                "p50_ms": _percentile(latencies, 50),
+                "p95_ms": _percentile(latencies, 95),
+                "p99_ms": _percentile(latencies, 99),
+            },
+            "recall": {f"@{k}": round(found[k] / len(judged), 4) if judged else 0.0 for k in RECALL_AT},
+            "baseline_rss_mb": baseline_rss,
+            "peak_rss_mb": round(_peak_rss_mb() - baseline_rss, 1),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _config() -> dict:
+    from app.config import settings
+
+    return {
+        "rag_top_k": settings.rag_top_k,
+        "rag_embedder": settings.rag_embedder,
+        "rag_embedding_dim": settings.rag_embedding_dim,
+        "rag_dense_weight": settings.rag_dense_weight,
+        "rag_ann_min_chunks": settings.rag_ann_min_chunks,
+        "rag_ann_nprobe": settings.rag_ann_nprobe,
+    }
+
+
+def run(sizes: List[int], queries: int, seed: int, workdir: Optional[str] = None) -> dict:
+    runs = []
+    for size in sizes:
+        # A fresh interpreter per size keeps peak RSS and caches from leaking between runs.
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_size, size, queries, seed, workdir).result()
+        print(
+            f"{result['chunks']:>9} chunks  ingest {result['ingest']['chunks_per_second']:>9} chunks/s  "
+            f"p50 {result['query']['p50_ms']:>8}ms  p99 {result['query']['p99_ms']:>8}ms  "
+            f"recall@4 {result['recall']['@4']:.3f}  rss {result['peak_rss_mb']}MB",
+            file=sys.stderr,
+        )
+        runs.append(result)
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": seed,
+        "queries": queries,
+        "config": _config(),
+        "runs": runs,
+    }
+
+
+def _flatten(data: dict, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline: dict, candidate: dict) -> List[str]:
+    lines = []
+    before = {run.get("target_chunks", run["documents"]): _flatten(run) for run in baseline["runs"]}
+    for run in candidate["runs"]:
+        previous = before.get(run.get("target_chunks", run["documents"]))
+        if previous is None:
+            continue
+        lines.append(f"{run['chunks']} chunks")
+        for metric, value in _flatten(run).items():
+            old = previous.get(metric)
+            if old is None or metric in {"target_chunks", "chunks", "documents", "query.count"}:
+                continue
+            change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            lines.append(f"  {metric:<28} {old:>12} -> {value:>12}  {change}")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.ai.kb_bench", description="Retrieval benchmark")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        with open(args.compare[1], encoding="utf-8") as handle:
+            candidate = json.load(handle)
+        print("\n".join(compare(baseline, candidate)))
+        return
+
+    report = run(args.chunks, args.queries, args.seed, args.workdir)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as handle:
+            handle.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
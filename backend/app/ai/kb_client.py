@@ -0,0 +1,73 @@
+import json
+import socket
+import threading
+import time
+from typing import Any, Dict
+
+from app.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger()
+
+WARN_INTERVAL_SECONDS = 30.0
+
+_local = threading.local()
+_last_warning = 0.0
+
+
+class ServiceUnavailable(ConnectionError):
+    pass
+
+
+def _close() -> None:
+    handle = getattr(_local, "handle", None)
+    if handle is not None:
+        try:
+            handle.close()
+            _local.sock.close()
+        except OSError:
+            pass
+    _local.handle = None
+
+
+def _connection(path: str):
+    handle = getattr(_local, "handle", None)
+    if handle is None or _local.path != path:
+        _close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(settings.rag_service_timeout)
+        sock.connect(path)
+        _local.sock = sock
+        _local.handle = sock.makefile("rwb")
+        _local.path = path
+    return _local.handle
+
+
+def _warn(path: str, exc: Exception) -> None:
+    global _last_warning
+    now = time.monotonic()
+    if now - _last_warning >= WARN_INTERVAL_SECONDS:
+        _last_warning = now
+        logger.warning("Retrieval service at %s is unavailable (%s); using the in-process index", path, exc)
+
+
+def request(path: str, op: str, params: Dict[str, Any]) -> Any:
+    payload = json.dumps({"op": op, **params}).encode("utf-8") + b"\n"
+    for attempt in range(2):
+        try:
+            handle = _connection(path)
+            handle.write(payload)
+            handle.flush()
+            line = handle.readline()
+            if not line:
+                raise ConnectionResetError("connection closed by retrieval service")
+            response = json.loads(line)
+            break
+        except OSError as exc:
+            _close()
+            if attempt:
+                _warn(path, exc)
+                raise ServiceUnavailable(str(exc)) from exc
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response["result"]
@@ -0,0 +1,216 @@
+import math
+import os
+import uuid
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _kmeans(sample: np.ndarray, clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=clusters)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def fit_centroids(sample: np.ndarray, total: int, nlist: int = 0, seed: int = 0) -> np.ndarray:
+    clusters = nlist or max(int(math.sqrt(total)), 1)
+    return _kmeans(sample, min(clusters, len(sample)), seed=seed)
+
+
+class DenseIndex:
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._dead = 0
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[array] = []
+        self._trained_size = 0
+        self.unsaved = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def has_ann(self) -> bool:
+        return self._centroids is not None
+
+    def _reserve(self, extra: int) -> None:
+        needed = self._size + extra
+        if needed <= self._matrix.shape[0]:
+            return
+        capacity = max(needed, self._matrix.shape[0] * 2, 1024)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[: self._size] = self._matrix[: self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self._size] = self._alive[: self._size]
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[: self._size] = self._assignments[: self._size]
+        self._matrix = matrix
+        self._alive = alive
+        self._assignments = assignments
+
+    def add(self, chunk_ids: Sequence[str], vectors: np.ndarray) -> None:
+        fresh = [row for row, chunk_id in enumerate(chunk_ids) if chunk_id not in self._rows]
+        if not fresh:
+            return
+        self._reserve(len(fresh))
+        start = self._size
+        stop = start + len(fresh)
+        self._matrix[start:stop] = vectors[fresh]
+        self._alive[start:stop] = True
+        for offset, row in enumerate(fresh):
+            self._rows[chunk_ids[row]] = start + offset
+            self._ids.append(chunk_ids[row])
+        self._size = stop
+        if self._centroids is not None:
+            self._assign(np.arange(start, stop))
+            self.unsaved += len(fresh)
+
+    def remove(self, chunk_ids: Sequence[str]) -> None:
+        for chunk_id in chunk_ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is not None:
+                self._alive[row] = False
+                self._dead += 1
+        if self._dead > 1024 and self._dead > self._size // 2:
+            self._compact()
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self._alive[: self._size])
+        self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._assignments = np.ascontiguousarray(self._assignments[keep])
+        self._ids = [self._ids[row] for row in keep]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._size = len(keep)
+        self._dead = 0
+        if self._centroids is not None:
+            self._rebuild_lists()
+
+    def _assign(self, rows: np.ndarray, batch_size: int = 8192) -> None:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            labels = np.argmax(self._matrix[batch] @ self._centroids.T, axis=1).astype(np.int32)
+            self._assignments[batch] = labels
+            for row, label in zip(batch.tolist(), labels.tolist()):
+                self._lists[label].append(row)
+
+    def _rebuild_lists(self) -> None:
+        self._lists = [array("i") for _ in range(len(self._centroids))]
+        assignments = self._assignments[: self._size]
+        unassigned = np.flatnonzero(assignments < 0)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self._centroids) + 1))
+        for label in range(len(self._centroids)):
+            self._lists[label].extend(order[bounds[label] : bounds[label + 1]].tolist())
+        if len(unassigned):
+            self._assign(unassigned)
+
+    def needs_training(self, min_size: int) -> bool:
+        if min_size <= 0 or len(self._rows) < min_size:
+            return False
+        return self._centroids is None or len(self._rows) > 4 * self._trained_size
+
+    def sample(self, sample_size: int = 32768, seed: int = 0) -> np.ndarray:
+        live = np.flatnonzero(self._alive[: self._size])
+        if len(live) > sample_size:
+            live = np.random.default_rng(seed).choice(live, size=sample_size, replace=False)
+        return self._matrix[live].copy()
+
+    def install_centroids(self, centroids: np.ndarray) -> None:
+        self._centroids = centroids
+        self._assignments[: self._size] = -1
+        self._rebuild_lists()
+        self._trained_size = len(self._rows)
+        self.unsaved = self._size
+
+    def train(self, nlist: int = 0, seed: int = 0) -> None:
+        if self._rows:
+            self.install_centroids(fit_centroids(self.sample(seed=seed), len(self._rows), nlist, seed))
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        probe = np.argsort(-(self._centroids @ query))[: max(nprobe, 1)]
+        parts = [np.frombuffer(self._lists[label], dtype=np.int32) for label in probe.tolist() if self._lists[label]]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.concatenate(parts)
+        return rows[self._alive[rows]]
+
+    def similarity(self, query: np.ndarray, chunk_ids: Sequence[str]) -> Dict[str, float]:
+        known = [(chunk_id, self._rows[chunk_id]) for chunk_id in chunk_ids if chunk_id in self._rows]
+        if not known:
+            return {}
+        scores = self._matrix[[row for _, row in known]] @ query
+        return {chunk_id: float(score) for (chunk_id, _), score in zip(known, scores)}
+
+    def search(self, query: np.ndarray, limit: int, nprobe: int = 8) -> List[Tuple[str, float]]:
+        if not self._rows or limit <= 0:
+            return []
+        if self._centroids is not None:
+            rows = self._candidates(query, nprobe)
+            scores = self._matrix[rows] @ query
+        else:
+            rows = np.flatnonzero(self._alive[: self._size])
+            scores = self._matrix[: self._size][rows] @ query if self._dead else self._matrix[: self._size] @ query
+        if not len(rows):
+            return []
+        limit = min(limit, len(rows))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[rows[position]], float(scores[position])) for position in top.tolist()]
+
+    def save_ann(self, path: str) -> None:
+        if self._centroids is None:
+            return
+        live = np.flatnonzero(self._alive[: self._size])
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as handle:
+            np.savez(
+                handle,
+                centroids=self._centroids,
+                ids=np.array([self._ids[row] for row in live.tolist()], dtype="U32"),
+                assignments=self._assignments[live],
+                trained_size=np.array([self._trained_size]),
+            )
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+        self.unsaved = 0
+
+    def load_ann(self, path: str) -> bool:
+        try:
+            with np.load(path) as data:
+                centroids = data["centroids"].astype(np.float32)
+                ids = data["ids"].tolist()
+                assignments = data["assignments"]
+                trained_size = int(data["trained_size"][0])
+        except (OSError, KeyError, ValueError):
+            return False
+        if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+            return False
+        self._centroids = centroids
+        self._assignments[: self._size] = -1
+        for chunk_id, label in zip(ids, assignments.tolist()):
+            row = self._rows.get(chunk_id)
+            if row is not None and 0 <= label < len(centroids):
+                self._assignments[row] = label
+        self._rebuild_lists()
+        self._trained_size = trained_size
+        self.unsaved = 0
+        return True
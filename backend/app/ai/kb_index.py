@@ -0,0 +1,231 @@
+import heapq
+import math
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+
+def _min_span(position_lists: Sequence[Tuple[int, ...]]) -> int:
+    heap = [(positions[0], term, 0) for term, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    right = max(position for position, _, _ in heap)
+    best = right - heap[0][0]
+    while True:
+        left, term, offset = heapq.heappop(heap)
+        best = min(best, right - left)
+        if offset + 1 == len(position_lists[term]):
+            return best + 1
+        following = position_lists[term][offset + 1]
+        right = max(right, following)
+        heapq.heappush(heap, (following, term, offset + 1))
+
+
+def _has_phrase(position_lists: Sequence[Tuple[int, ...]]) -> bool:
+    starts = set(position_lists[0])
+    for offset, positions in enumerate(position_lists[1:], start=1):
+        starts &= {position - offset for position in positions}
+        if not starts:
+            return False
+    return True
+
+
+FUZZY_CANDIDATES = 64
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f"#{term}#"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    # Optimal string alignment distance, so a swapped pair ("recieve") counts as one edit.
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class InvertedIndex:
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        phrase_bonus: float = 2.0,
+        proximity_bonus: float = 1.0,
+        proximity_window: int = 8,
+        max_edits: int = 2,
+        fuzzy_weight: float = 0.7,
+    ) -> None:
+        self.k1 = k1
+        self.b = b
+        self.phrase_bonus = phrase_bonus
+        self.proximity_bonus = proximity_bonus
+        self.proximity_window = proximity_window
+        self.max_edits = max_edits
+        self.fuzzy_weight = fuzzy_weight
+        self._postings: Dict[str, Dict[str, Tuple[int, ...]]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, Tuple[str, ...]] = {}
+        self._refs: Dict[str, int] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._doc_chunks: Dict[str, List[str]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._lengths
+
+    def document_chunks(self, doc_id: str) -> List[str]:
+        return list(self._doc_chunks.get(doc_id, ()))
+
+    def add(self, chunk_id: str, doc_id: str, tokens: List[str]) -> None:
+        self._doc_chunks.setdefault(doc_id, []).append(chunk_id)
+        if chunk_id in self._lengths:
+            self._refs[chunk_id] += 1
+            return
+        positions: Dict[str, List[int]] = {}
+        for position, token in enumerate(tokens):
+            positions.setdefault(token, []).append(position)
+        for term, offsets in positions.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                for gram in _trigrams(term):
+                    self._grams.setdefault(gram, set()).add(term)
+            posting[chunk_id] = tuple(offsets)
+        self._terms[chunk_id] = tuple(positions)
+        self._lengths[chunk_id] = len(tokens)
+        self._refs[chunk_id] = 1
+        self._total_length += len(tokens)
+
+    def remove_chunk(self, chunk_id: str) -> None:
+        length = self._lengths.pop(chunk_id, None)
+        if length is None:
+            return
+        self._refs.pop(chunk_id, None)
+        self._total_length -= length
+        for term in self._terms.pop(chunk_id, ()):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(chunk_id, None)
+            if not posting:
+                del self._postings[term]
+                for gram in _trigrams(term):
+                    terms = self._grams.get(gram)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self._grams[gram]
+
+    def remove_from_document(self, doc_id: str, chunk_ids: List[str]) -> List[str]:
+        owned = self._doc_chunks.get(doc_id)
+        if not owned:
+            return []
+        targets = set(chunk_ids)
+        self._doc_chunks[doc_id] = [chunk_id for chunk_id in owned if chunk_id not in targets]
+        removed = []
+        for chunk_id in dict.fromkeys(chunk_id for chunk_id in owned if chunk_id in targets):
+            refs = self._refs.get(chunk_id, 0) - 1
+            if refs > 0:
+                self._refs[chunk_id] = refs
+            else:
+                self.remove_chunk(chunk_id)
+                removed.append(chunk_id)
+        return removed
+
+    def remove_document(self, doc_id: str) -> List[str]:
+        removed = self.remove_from_document(doc_id, self.document_chunks(doc_id))
+        self._doc_chunks.pop(doc_id, None)
+        return removed
+
+    def fuzzy_match(self, token: str) -> Optional[str]:
+        if self.max_edits <= 0 or len(token) < 4 or any(char.isdigit() for char in token):
+            return None
+        limit = 1 if len(token) < 8 else self.max_edits
+        grams = _trigrams(token)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for term in self._grams.get(gram, ()):
+                shared[term] = shared.get(term, 0) + 1
+        # An edit touches at most three trigrams (four for a swapped pair), so terms sharing fewer
+        # than this cannot be within the limit and are never verified.
+        floor = max(len(grams) - 4 * limit, 1)
+        candidates = [
+            (count, -abs(len(term) - len(token)), term)
+            for term, count in shared.items()
+            if count >= floor and abs(len(term) - len(token)) <= limit
+        ]
+        best: Optional[Tuple[int, int, str]] = None
+        for _, _, term in heapq.nlargest(FUZZY_CANDIDATES, candidates):
+            distance = _edit_distance(token, term, limit)
+            if distance <= limit:
+                candidate = (distance, -len(self._postings[term]), term)
+                if best is None or candidate < best:
+                    best = candidate
+        return best[2] if best else None
+
+    def _resolve(self, query_tokens: List[str]) -> Tuple[List[str], Dict[str, float]]:
+        resolved = []
+        weights: Dict[str, float] = {}
+        for token in query_tokens:
+            if token not in self._postings:
+                match = self.fuzzy_match(token)
+                if match is not None:
+                    weights.setdefault(match, self.fuzzy_weight)
+                    token = match
+            weights.setdefault(token, 1.0)
+            resolved.append(token)
+        return resolved, weights
+
+    def search(self, query_tokens: List[str], limit: int) -> List[Tuple[str, float]]:
+        total = len(self._lengths)
+        if not total or not query_tokens or limit <= 0:
+            return []
+        avg_length = self._total_length / total or 1.0
+        scores: Dict[str, float] = {}
+        matched: Dict[str, int] = {}
+        query_tokens, weights = self._resolve(query_tokens)
+        terms = list(dict.fromkeys(query_tokens))
+        for term in terms:
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = weights[term] * math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for chunk_id, positions in posting.items():
+                tf = len(positions)
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[chunk_id] = matched.get(chunk_id, 0) + 1
+        if not scores:
+            return []
+        if len(terms) > 1:
+            for chunk_id, count in matched.items():
+                if count > 1:
+                    scores[chunk_id] += self._position_bonus(chunk_id, query_tokens, terms, count)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def _position_bonus(self, chunk_id: str, query_tokens: List[str], terms: List[str], count: int) -> float:
+        present = [self._postings[term][chunk_id] for term in terms if chunk_id in self._postings.get(term, {})]
+        bonus = 0.0
+        span = _min_span(present)
+        if span - count < self.proximity_window:
+            coverage = (count - 1) / (len(terms) - 1)
+            bonus += self.proximity_bonus * coverage * (1 - (span - count) / self.proximity_window)
+        if count == len(terms):
+            phrase = [self._postings[term][chunk_id] for term in query_tokens]
+            if _has_phrase(phrase):
+                bonus += self.phrase_bonus
+        return bonus
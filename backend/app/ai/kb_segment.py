@@ -0,0 +1,127 @@
+import mmap
+import os
+import struct
+import uuid
+from array import array
+from typing import Iterator, Optional, Tuple
+
+# Segment layout:
+#   magic | UTF-8 text blob | uint64 offsets[count + 1] | uint32 doc ordinals[count]
+#   | 16-byte chunk ids[count] | little-endian footer
+# The tables trail the blob so a writer can stream text to disk before it
+# knows how many chunks there will be.
+MAGIC = b"KBSEG001"
+_FOOTER = struct.Struct("<QQQQQ8s")
+_ID_SIZE = 16
+
+
+def chunk_id_bytes(chunk_id: str) -> bytes:
+    try:
+        raw = bytes.fromhex(chunk_id)
+    except ValueError:
+        raw = b""
+    if len(raw) != _ID_SIZE:
+        raw = uuid.uuid5(uuid.NAMESPACE_OID, chunk_id).bytes
+    return raw
+
+
+class SegmentWriter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._handle = open(self._tmp_path, "wb")
+        self._handle.write(MAGIC)
+        self._offsets = array("Q", [0])
+        self._docs = array("I")
+        self._ids = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def append(self, chunk_id: str, doc_ordinal: int, text: str) -> None:
+        encoded = text.encode("utf-8")
+        self._handle.write(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+        self._docs.append(doc_ordinal)
+        self._ids += chunk_id_bytes(chunk_id)
+
+    def commit(self) -> bool:
+        if not self._docs:
+            self.abort()
+            return False
+        handle = self._handle
+        blob_start = len(MAGIC)
+        offsets_start = blob_start + self._offsets[-1]
+        docs_start = offsets_start + self._offsets.itemsize * len(self._offsets)
+        ids_start = docs_start + self._docs.itemsize * len(self._docs)
+        handle.write(self._offsets.tobytes())
+        handle.write(self._docs.tobytes())
+        handle.write(bytes(self._ids))
+        handle.write(_FOOTER.pack(len(self._docs), blob_start, offsets_start, docs_start, ids_start, MAGIC))
+        handle.flush()
+        os.fsync(handle.fileno())
+        handle.close()
+        os.replace(self._tmp_path, self.path)
+        return True
+
+    def abort(self) -> None:
+        self._handle.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class SegmentReader:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        count, blob_start, offsets_start, docs_start, ids_start, magic = _FOOTER.unpack_from(
+            self._map, len(self._map) - _FOOTER.size
+        )
+        if magic != MAGIC or self._map[: len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a knowledge base segment: {path}")
+        view = memoryview(self._map)
+        self._view = view
+        self._count = count
+        self._blob_start = blob_start
+        self._offsets = view[offsets_start:docs_start].cast("Q")
+        self._docs = view[docs_start:ids_start].cast("I")
+        self._ids_start = ids_start
+
+    def __len__(self) -> int:
+        return self._count
+
+    def text(self, row: int) -> str:
+        start = self._blob_start + self._offsets[row]
+        end = self._blob_start + self._offsets[row + 1]
+        return self._map[start:end].decode("utf-8")
+
+    def doc_ordinal(self, row: int) -> int:
+        return self._docs[row]
+
+    def chunk_id(self, row: int) -> str:
+        start = self._ids_start + row * _ID_SIZE
+        return self._map[start : start + _ID_SIZE].hex()
+
+    def rows(self) -> Iterator[Tuple[int, str, int]]:
+        for row in range(self._count):
+            yield row, self.chunk_id(row), self._docs[row]
+
+    def close(self) -> None:
+        self._offsets.release()
+        self._docs.release()
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:  # pragma: no cover
+            pass
+
+
+def open_segment(path: str) -> Optional[SegmentReader]:
+    try:
+        return SegmentReader(path)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+from typing import Any, Callable, Dict
+
+from app.ai import rag
+from app.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger()
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "search": lambda params: rag.search_knowledge_base_hits(params["query"], params["limit"], params.get("tenant_id")),
+    "index": lambda params: rag.index_document(params["doc_id"], params.get("tenant_id")),
+    "delete": lambda params: rag.delete_document(params["doc_id"], params.get("tenant_id")),
+    "documents": lambda params: rag.list_documents(params.get("tenant_id")),
+    "find": lambda params: rag.find_document_by_hash(params["sha256"], params.get("tenant_id")),
+    "stats": lambda params: rag.retrieval_cache_stats(),
+}
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+                handler = HANDLERS[message.pop("op")]
+                response = {"result": await asyncio.to_thread(handler, message)}
+            except Exception as exc:
+                response = {"error": f"{type(exc).__name__}: {exc}"}
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _remove_stale_socket(path: str) -> None:
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"A retrieval service is already listening on {path}")
+
+
+async def serve(path: str) -> None:
+    # This process owns the index; it must never forward requests to itself.
+    os.environ["RAG_SERVICE_SOCKET"] = ""
+    settings.rag_service_socket = ""
+    _remove_stale_socket(path)
+    server = await asyncio.start_unix_server(_handle, path=path, limit=1 << 20)
+    os.chmod(path, 0o660)
+    logger.info("Retrieval service listening on %s", path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else settings.rag_service_socket
+    if not target:
+        raise SystemExit("Pass a socket path or set RAG_SERVICE_SOCKET")
+    asyncio.run(serve(target))
@@ -0,0 +1,606 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from app.ai.kb_segment import SegmentReader, SegmentWriter, open_segment
+from app.utils.logger import get_logger
+
+logger = get_logger()
+
+MANIFEST_FILE = "manifest.json"
+ORDINAL_FILE = "ordinal"
+LEGACY_INDEX_FILE = "index.json"
+SEGMENT_DIR = "segments"
+SEGMENT_SUFFIX = ".seg"
+COMPANION_SUFFIX = ".npy"
+COMPACT_MAX_SEGMENTS = 32
+COMPACT_DEAD_RATIO = 0.3
+ORPHAN_GRACE_SECONDS = 3600
+
+
+class CompactedDuringAppend(RuntimeError):
+    pass
+
+
+class StoredChunk(NamedTuple):
+    chunk_id: str
+    doc_id: str
+    text: str
+    segment: str
+    row: int
+
+
+def _empty_manifest() -> dict:
+    return {"next_ordinal": 0, "segments": [], "documents": [], "deleted": []}
+
+
+def _parts(doc: dict) -> List[dict]:
+    return doc.get("parts") or [{"ordinal": doc["ordinal"], "segment": doc.get("segment")}]
+
+
+def _dropped_by_ordinal(manifest: dict) -> Dict[int, Set[str]]:
+    dropped: Dict[int, Set[str]] = {}
+    for doc in manifest["documents"]:
+        if doc.get("dropped"):
+            chunk_ids = set(doc["dropped"])
+            for part in _parts(doc):
+                dropped[part["ordinal"]] = chunk_ids
+    return dropped
+
+
+def _layout(doc: dict) -> Tuple[List[int], List[str]]:
+    return [part["ordinal"] for part in _parts(doc)], sorted(doc.get("dropped", ()))
+
+
+def _is_dead(ordinal: int, chunk_id: str, deleted: Set[int], dropped: Dict[int, Set[str]]) -> bool:
+    return ordinal in deleted or chunk_id in dropped.get(ordinal, ())
+
+
+def _segment_name() -> str:
+    return f"seg-{uuid.uuid4().hex}{SEGMENT_SUFFIX}"
+
+
+def companion_path(segment_path: str, key: str) -> str:
+    stem = segment_path[: -len(SEGMENT_SUFFIX)] if segment_path.endswith(SEGMENT_SUFFIX) else segment_path
+    return f"{stem}.{key}{COMPANION_SUFFIX}"
+
+
+def save_companion(path: str, matrix: np.ndarray) -> None:
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as handle:
+        np.save(handle, matrix)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_atomic(path: str, payload: dict) -> None:
+    _write_text_atomic(path, json.dumps(payload, ensure_ascii=False))
+
+
+def _write_text_atomic(path: str, text: str) -> None:
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        handle.write(text)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+class SegmentStore:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.segment_dir = os.path.join(root, SEGMENT_DIR)
+        self._manifest_path = os.path.join(root, MANIFEST_FILE)
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._manifest = _empty_manifest()
+        self._dropped: Dict[int, Set[str]] = {}
+        self._manifest_stamp: Optional[Tuple[int, int]] = None
+        self._readers: Dict[str, SegmentReader] = {}
+        self._locations: Dict[str, Tuple[SegmentReader, int]] = {}
+        os.makedirs(self.segment_dir, exist_ok=True)
+        with self._locked():
+            convert_legacy_index(root)
+        self._sync()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock, _manifest_lock(self.root):
+            yield
+
+    def _read_manifest(self) -> dict:
+        return _read_manifest(self.root)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        _write_atomic(self._manifest_path, manifest)
+        self._apply(manifest, self._stamp())
+
+    def _stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._manifest_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _sync(self) -> None:
+        with self._lock:
+            stamp = self._stamp()
+            if stamp is not None and stamp != self._manifest_stamp:
+                self._apply(self._read_manifest(), stamp)
+
+    def _apply(self, manifest: dict, stamp: Optional[Tuple[int, int]]) -> None:
+        live = set(manifest["segments"])
+        lost = set()
+        for name in [name for name in self._readers if name not in live]:
+            reader = self._readers.pop(name)
+            for _, chunk_id, _ in reader.rows():
+                location = self._locations.get(chunk_id)
+                if location and location[0] is reader:
+                    del self._locations[chunk_id]
+                    lost.add(chunk_id)
+
+        deleted = set(manifest["deleted"])
+        dropped = _dropped_by_ordinal(manifest)
+        if deleted - set(self._manifest["deleted"]) or dropped != self._dropped:
+            dead = [
+                chunk_id
+                for chunk_id, (reader, row) in self._locations.items()
+                if _is_dead(reader.doc_ordinal(row), chunk_id, deleted, dropped)
+            ]
+            for chunk_id in dead:
+                del self._locations[chunk_id]
+            lost.update(dead)
+            lost.update(set().union(*self._dropped.values()) - set().union(*dropped.values()))
+
+        for name in manifest["segments"]:
+            if name in self._readers:
+                continue
+            reader = open_segment(os.path.join(self.segment_dir, name))
+            if reader is None:
+                logger.warning("Knowledge base segment %s is missing or unreadable", name)
+                continue
+            self._readers[name] = reader
+            for row, chunk_id, ordinal in reader.rows():
+                if not _is_dead(ordinal, chunk_id, deleted, dropped):
+                    self._locations[chunk_id] = (reader, row)
+
+        # Chunk ids are content hashes, so a chunk dropped with one document may live on in another.
+        lost.difference_update(self._locations)
+        if lost:
+            for reader in self._readers.values():
+                for row, chunk_id, ordinal in reader.rows():
+                    if chunk_id in lost and not _is_dead(ordinal, chunk_id, deleted, dropped):
+                        self._locations[chunk_id] = (reader, row)
+                        lost.discard(chunk_id)
+
+        self._manifest = manifest
+        self._dropped = dropped
+        self._manifest_stamp = stamp
+
+    def stamp(self) -> Optional[Tuple[int, int]]:
+        self._sync()
+        with self._lock:
+            return self._manifest_stamp
+
+    def documents(self) -> List[dict]:
+        self._sync()
+        with self._lock:
+            return [
+                {"id": doc["id"], "filename": doc["filename"], "chunks": doc["chunks"], "version": doc.get("version", 1)}
+                for doc in self._manifest["documents"]
+            ]
+
+    def find_document(self, sha256: str) -> Optional[dict]:
+        self._sync()
+        with self._lock:
+            return _find_by_hash(self._manifest, sha256)
+
+    def iter_chunks(self) -> Iterator[StoredChunk]:
+        self._sync()
+        with self._lock:
+            doc_ids = {part["ordinal"]: doc["id"] for doc in self._manifest["documents"] for part in _parts(doc)}
+            dropped = self._dropped
+            readers = list(self._readers.items())
+        for name, reader in readers:
+            for row, chunk_id, ordinal in reader.rows():
+                doc_id = doc_ids.get(ordinal)
+                if doc_id is not None and chunk_id not in dropped.get(ordinal, ()):
+                    yield StoredChunk(chunk_id, doc_id, reader.text(row), name, row)
+
+    def iter_document(self, doc_id: str) -> Iterator[StoredChunk]:
+        self._sync()
+        with self._lock:
+            doc = next((doc for doc in self._manifest["documents"] if doc["id"] == doc_id), None)
+            if doc is None:
+                return
+            ordinals = {part["ordinal"] for part in _parts(doc)}
+            segments = dict.fromkeys(part["segment"] for part in _parts(doc) if part.get("segment"))
+            readers = [(name, self._readers.get(name)) for name in segments]
+            dropped = set(doc.get("dropped", ()))
+        for name, reader in readers:
+            if reader is None:
+                continue
+            for row, chunk_id, ordinal in reader.rows():
+                if ordinal in ordinals and chunk_id not in dropped:
+                    yield StoredChunk(chunk_id, doc_id, reader.text(row), name, row)
+
+    def reader(self, segment: str) -> Optional[SegmentReader]:
+        with self._lock:
+            return self._readers.get(segment)
+
+    def segment_path(self, segment: str) -> str:
+        return os.path.join(self.segment_dir, segment)
+
+    def text(self, chunk_id: str) -> Optional[str]:
+        with self._lock:
+            location = self._locations.get(chunk_id)
+            if location is None:
+                return None
+            reader, row = location
+            return reader.text(row)
+
+    def append_document(
+        self,
+        document: dict,
+        chunks: Iterable[Tuple[str, str]],
+        on_segment: Optional[Callable[[str], None]] = None,
+    ) -> dict:
+        created = append_document(self.root, document, chunks, on_segment)
+        self._sync()
+        self.maybe_compact()
+        return created
+
+    def delete_document(self, doc_id: str) -> bool:
+        with self._locked():
+            manifest = self._read_manifest()
+            doc = next((doc for doc in manifest["documents"] if doc["id"] == doc_id), None)
+            if doc is None:
+                self._apply(manifest, self._stamp())
+                return False
+            manifest["documents"] = [item for item in manifest["documents"] if item["id"] != doc_id]
+            manifest["deleted"].extend(part["ordinal"] for part in _parts(doc) if part.get("segment"))
+            self._write_manifest(manifest)
+        self.maybe_compact()
+        return True
+
+    def _needs_compaction(self, manifest: dict) -> bool:
+        if len(manifest["segments"]) > COMPACT_MAX_SEGMENTS:
+            return True
+        dropped = sum(len(doc.get("dropped", ())) for doc in manifest["documents"])
+        if dropped:
+            live_chunks = sum(doc["chunks"] for doc in manifest["documents"])
+            if dropped / (live_chunks + dropped) >= COMPACT_DEAD_RATIO:
+                return True
+        if not manifest["deleted"]:
+            return False
+        live = len(manifest["documents"])
+        return len(manifest["deleted"]) / (live + len(manifest["deleted"])) >= COMPACT_DEAD_RATIO
+
+    def maybe_compact(self) -> None:
+        self._sync()
+        with self._lock:
+            if self._compacting or not self._needs_compaction(self._manifest):
+                return
+            self._compacting = True
+        threading.Thread(target=self._run_compaction, name="kb-compaction", daemon=True).start()
+
+    def _run_compaction(self) -> None:
+        try:
+            self.compact()
+        except Exception:  # pragma: no cover
+            logger.exception("Knowledge base compaction failed for %s", self.root)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self) -> None:
+        self._sync()
+        with self._lock:
+            snapshot = list(self._manifest["segments"])
+            deleted = set(self._manifest["deleted"])
+            dropped = self._dropped
+        readers = [open_segment(self.segment_path(name)) for name in snapshot]
+        merged_name = _segment_name()
+        writer = SegmentWriter(self.segment_path(merged_name))
+        kept: List[List[int]] = []
+        try:
+            for reader in readers:
+                if reader is None:
+                    writer.abort()
+                    return
+                rows = []
+                for row, chunk_id, ordinal in reader.rows():
+                    if not _is_dead(ordinal, chunk_id, deleted, dropped):
+                        writer.append(chunk_id, ordinal, reader.text(row))
+                        rows.append(row)
+                kept.append(rows)
+            lengths = [len(reader) for reader in readers]
+        finally:
+            for reader in readers:
+                if reader is not None:
+                    reader.close()
+        written = writer.commit()
+        if written:
+            self._merge_companions(snapshot, lengths, kept, merged_name)
+
+        with self._locked():
+            manifest = self._read_manifest()
+            current = _dropped_by_ordinal(manifest)
+            removed = set(manifest["deleted"])
+            restored = any(
+                chunk_ids - current.get(ordinal, set())
+                for ordinal, chunk_ids in dropped.items()
+                if ordinal not in removed
+            )
+            if restored or any(name not in manifest["segments"] for name in snapshot):
+                self._apply(manifest, self._stamp())
+                if written:
+                    self._remove_unreferenced(set(manifest["segments"]), {merged_name})
+                return
+            compacted = set(snapshot)
+            newer = [name for name in manifest["segments"] if name not in compacted]
+            manifest["segments"] = ([merged_name] if written else []) + newer
+            manifest["deleted"] = [ordinal for ordinal in manifest["deleted"] if ordinal not in deleted]
+            for doc in manifest["documents"]:
+                if doc.get("segment") in compacted:
+                    doc["segment"] = merged_name if written else None
+                for part in doc.get("parts", ()):
+                    if part.get("segment") in compacted:
+                        part["segment"] = merged_name if written else None
+                if doc.get("dropped"):
+                    purged = dropped.get(_parts(doc)[0]["ordinal"], set())
+                    doc["dropped"] = [chunk_id for chunk_id in doc["dropped"] if chunk_id not in purged]
+            self._write_manifest(manifest)
+            self._remove_unreferenced(set(manifest["segments"]), compacted)
+
+    def _companion_keys(self, segment: str) -> List[str]:
+        stem = segment[: -len(SEGMENT_SUFFIX)] + "."
+        return [
+            name[len(stem) : -len(COMPANION_SUFFIX)]
+            for name in os.listdir(self.segment_dir)
+            if name.startswith(stem) and name.endswith(COMPANION_SUFFIX)
+        ]
+
+    def _merge_companions(self, snapshot: List[str], lengths: List[int], kept: List[List[int]], merged: str) -> None:
+        if not snapshot:
+            return
+        keys = set(self._companion_keys(snapshot[0]))
+        for name in snapshot[1:]:
+            keys &= set(self._companion_keys(name))
+        for key in keys:
+            parts = []
+            for name, length, rows in zip(snapshot, lengths, kept):
+                matrix = np.load(companion_path(self.segment_path(name), key), mmap_mode="r")
+                if matrix.shape[0] != length:
+                    break
+                parts.append(np.asarray(matrix[rows]))
+            else:
+                save_companion(companion_path(self.segment_path(merged), key), np.concatenate(parts))
+
+    def _remove_unreferenced(self, live: set, compacted: set) -> None:
+        now = time.time()
+        live_stems = {name[: -len(SEGMENT_SUFFIX)] for name in live}
+        dead_stems = {name[: -len(SEGMENT_SUFFIX)] for name in compacted}
+        for name in os.listdir(self.segment_dir):
+            stem = name.split(".", 1)[0]
+            if stem in live_stems:
+                continue
+            path = os.path.join(self.segment_dir, name)
+            try:
+                if stem in dead_stems or now - os.path.getmtime(path) > ORPHAN_GRACE_SECONDS:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "segments": len(self._manifest["segments"]),
+                "documents": len(self._manifest["documents"]),
+                "deleted": len(self._manifest["deleted"]),
+                "chunks": len(self._locations),
+            }
+
+
+@contextmanager
+def _manifest_lock(root: str) -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(root, f"{MANIFEST_FILE}.lock"), "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _read_manifest(root: str) -> dict:
+    path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return _empty_manifest()
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _find_by_hash(manifest: dict, sha256: Optional[str]) -> Optional[dict]:
+    if not sha256:
+        return None
+    for doc in manifest["documents"]:
+        if doc.get("sha256") == sha256:
+            return {
+                "id": doc["id"],
+                "filename": doc["filename"],
+                "chunks": doc["chunks"],
+                "version": doc.get("version", 1),
+                "duplicate": True,
+            }
+    return None
+
+
+def _remove_segment_files(root: str, name: str) -> None:
+    stem = name[: -len(SEGMENT_SUFFIX)]
+    segment_dir = os.path.join(root, SEGMENT_DIR)
+    for filename in os.listdir(segment_dir):
+        if filename == name or (filename.startswith(stem + ".") and filename.endswith(COMPANION_SUFFIX)):
+            try:
+                os.remove(os.path.join(segment_dir, filename))
+            except OSError:
+                pass
+
+
+def _document_chunk_ids(root: str, doc: dict) -> Set[str]:
+    ordinals = {part["ordinal"] for part in _parts(doc)}
+    chunk_ids: Set[str] = set()
+    for name in dict.fromkeys(part["segment"] for part in _parts(doc) if part.get("segment")):
+        reader = open_segment(os.path.join(root, SEGMENT_DIR, name))
+        if reader is None:
+            continue
+        try:
+            chunk_ids.update(chunk_id for _, chunk_id, ordinal in reader.rows() if ordinal in ordinals)
+        finally:
+            reader.close()
+    return chunk_ids
+
+
+def _reserve_ordinal(root: str, manifest: dict) -> int:
+    # Reserved in a small side file so an append does not rewrite the whole manifest twice.
+    path = os.path.join(root, ORDINAL_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            reserved = int(handle.read().strip() or 0)
+    except (OSError, ValueError):
+        reserved = 0
+    ordinal = max(reserved, manifest["next_ordinal"])
+    _write_text_atomic(path, str(ordinal + 1))
+    return ordinal
+
+
+def append_document(
+    root: str,
+    document: dict,
+    chunks: Iterable[Tuple[str, str]],
+    on_segment: Optional[Callable[[str], None]] = None,
+) -> dict:
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    with _manifest_lock(root):
+        convert_legacy_index(root)
+        manifest = _read_manifest(root)
+        existing = _find_by_hash(manifest, document.get("sha256"))
+        if existing is not None:
+            return existing
+        previous = next(
+            (doc for doc in reversed(manifest["documents"]) if doc["filename"] == document["filename"]), None
+        )
+        ordinal = _reserve_ordinal(root, manifest)
+    # A re-upload under the same filename becomes a new version: only chunks that no earlier
+    # version stored are written, and chunks the new text no longer contains are tombstoned.
+    stored = _document_chunk_ids(root, previous) if previous else set()
+    current: Set[str] = set()
+    name = _segment_name()
+    writer = SegmentWriter(os.path.join(root, SEGMENT_DIR, name))
+    try:
+        for chunk_id, text in chunks:
+            current.add(chunk_id)
+            if chunk_id not in stored:
+                writer.append(chunk_id, ordinal, text)
+    except BaseException:
+        writer.abort()
+        raise
+    written = writer.commit()
+    if written and on_segment is not None:
+        on_segment(os.path.join(root, SEGMENT_DIR, name))
+    part = {"ordinal": ordinal, "segment": name if written else None}
+    with _manifest_lock(root):
+        manifest = _read_manifest(root)
+        existing = _find_by_hash(manifest, document.get("sha256"))
+        target = None
+        if previous is not None:
+            target = next((doc for doc in manifest["documents"] if doc["id"] == previous["id"]), None)
+        conflict = previous is not None and (
+            target is None or target.get("version", 1) != previous.get("version", 1)
+        )
+        # Compaction keeps the version but may have purged dropped chunks that `stored` still counts.
+        compacted = not conflict and previous is not None and _layout(target) != _layout(previous)
+        if existing is not None or conflict or compacted:
+            if written:
+                _remove_segment_files(root, name)
+            if existing is not None:
+                return existing
+            if compacted:
+                raise CompactedDuringAppend(f"{document['filename']} was compacted during upload; retry")
+            raise RuntimeError(f"{document['filename']} was changed by another upload; retry")
+        manifest["next_ordinal"] = max(manifest["next_ordinal"], ordinal + 1)
+        if written:
+            manifest["segments"].append(name)
+        if target is None:
+            entry = {**document, "chunks": len(current), "version": 1, **part}
+            manifest["documents"].append(entry)
+        else:
+            entry = target
+            entry["parts"] = _parts(target) + ([part] if written else [])
+            entry["dropped"] = sorted(stored - current)
+            entry["chunks"] = len(current)
+            entry["sha256"] = document.get("sha256")
+            entry["version"] = target.get("version", 1) + 1
+        _write_atomic(manifest_path, manifest)
+    return {
+        "id": entry["id"],
+        "filename": entry["filename"],
+        "chunks": entry["chunks"],
+        "version": entry["version"],
+        "duplicate": False,
+    }
+
+
+def convert_legacy_index(root: str) -> Optional[dict]:
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        return None
+    os.makedirs(os.path.join(root, SEGMENT_DIR), exist_ok=True)
+    manifest = _empty_manifest()
+    legacy_path = os.path.join(root, LEGACY_INDEX_FILE)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as handle:
+            legacy = json.load(handle)
+        ordinals: Dict[str, int] = {}
+        for doc in legacy.get("documents", []):
+            ordinals[doc["id"]] = len(ordinals)
+            manifest["documents"].append({**doc, "ordinal": ordinals[doc["id"]], "segment": None})
+        manifest["next_ordinal"] = len(ordinals)
+        name = _segment_name()
+        writer = SegmentWriter(os.path.join(root, SEGMENT_DIR, name))
+        for chunk in legacy.get("chunks", []):
+            ordinal = ordinals.get(chunk.get("doc_id"))
+            if ordinal is not None:
+                writer.append(chunk["id"], ordinal, chunk.get("text", ""))
+        if writer.commit():
+            manifest["segments"].append(name)
+            for doc in manifest["documents"]:
+                doc["segment"] = name
+    _write_atomic(manifest_path, manifest)
+    return manifest
+
+
+if __name__ == "__main__":
+    from app.config import settings
+
+    target = sys.argv[1] if len(sys.argv) > 1 else settings.kb_path
+    converted = convert_legacy_index(target)
+    if converted is None:
+        print(f"{target} already has a {MANIFEST_FILE}; nothing to convert")
+    else:
+        print(f"Converted {len(converted['documents'])} documents into {len(converted['segments'])} segment(s)")
@@ -0,0 +1,106 @@
+import re
+import threading
+from typing import Hashable, NamedTuple, Optional, Tuple
+
+from app.config import settings
+from app.utils.cache import LRUCache
+
+DEFAULT_LANGUAGE = "en"
+
+_detections = LRUCache(4096)
+_conversations = LRUCache(10000)
+_model = None
+_model_path: Optional[str] = None
+_model_lock = threading.Lock()
+
+
+class _ConversationLanguage(NamedTuple):
+    language: Optional[str]
+    pending: str
+
+
+def _letters(text: str) -> int:
+    return sum(1 for char in text if char.isalpha())
+
+
+def _load_model():
+    global _model, _model_path
+    path = settings.lang_detect_model
+    with _model_lock:
+        if _model is not None and _model_path == path:
+            return _model
+        if path:
+            try:
+                import fasttext
+            except ImportError as exc:  # pragma: no cover
+                raise RuntimeError("LANG_DETECT_MODEL requires the fasttext package.") from exc
+            _model = fasttext.load_model(path)
+        else:
+            from langdetect import DetectorFactory, detector_factory
+
+            # Seeded so the same text always gets the same answer.
+            DetectorFactory.seed = 0
+            detector_factory.init_factory()
+            _model = detector_factory._factory
+        _model_path = path
+        return _model
+
+
+def warm_up() -> None:
+    _load_model()
+
+
+def _run_detector(text: str) -> Tuple[str, float]:
+    model = _load_model()
+    if settings.lang_detect_model:
+        labels, scores = model.predict(text.replace("\n", " "))
+        return labels[0].replace("__label__", ""), float(scores[0])
+    from langdetect.lang_detect_exception import LangDetectException
+
+    try:
+        detector = model.create()
+        detector.append(text)
+        best = detector.get_probabilities()[0]
+    except (LangDetectException, IndexError):
+        return DEFAULT_LANGUAGE, 0.0
+    return best.lang, best.prob
+
+
+def detect_language(text: str) -> Tuple[str, float]:
+    key = re.sub(r"\s+", " ", text.strip().lower())
+    cached = _detections.get(key)
+    if cached is None:
+        cached = _run_detector(key) if key else (DEFAULT_LANGUAGE, 0.0)
+        _detections.put(key, cached)
+    return cached
+
+
+def conversation_language(conversation_key: Optional[Hashable], message: str) -> str:
+    if conversation_key is None:
+        if _letters(message) < settings.lang_detect_min_chars:
+            return DEFAULT_LANGUAGE
+        language, confidence = detect_language(message)
+        return language if confidence >= settings.lang_detect_confidence else DEFAULT_LANGUAGE
+
+    state = _conversations.get(conversation_key) or _ConversationLanguage(None, "")
+    if state.language is None:
+        # Undecided: pool short messages until there is enough text to judge.
+        pending = f"{state.pending} {message}".strip()[-1000:]
+        if _letters(pending) >= settings.lang_detect_min_chars:
+            detected, confidence = detect_language(pending)
+            if confidence >= settings.lang_detect_confidence:
+                _conversations.put(conversation_key, _ConversationLanguage(detected, ""))
+                return detected
+        _conversations.put(conversation_key, _ConversationLanguage(None, pending))
+        return DEFAULT_LANGUAGE
+
+    if _letters(message) >= settings.lang_switch_min_chars:
+        detected, confidence = detect_language(message)
+        if detected != state.language and confidence >= settings.lang_switch_confidence:
+            _conversations.put(conversation_key, _ConversationLanguage(detected, ""))
+            return detected
+    return state.language
+
+
+def language_stats() -> dict:
+    return {"detections": _detections.stats(), "conversations": _conversations.stats()}
@@ -1,18 +1,166 @@
-from typing import Tuple
+import asyncio
+import hashlib
+import importlib.util
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
 
-from openai import AsyncOpenAI
+import httpx
+from openai import APIStatusError, AsyncOpenAI, BadRequestError
 
 from app.config import settings
+from app.utils.logger import get_logger
 
+logger = get_logger()
 
-def get_llm_client() -> Tuple[AsyncOpenAI, str]:
-    provider = settings.ai_provider.lower()
-    api_key = settings.ai_api_key
-    base_url = settings.ai_base_url or None
+LATENCY_WINDOW = 200
+OUTCOME_WINDOW = 20
+MIN_LATENCY_SAMPLES = 20
 
-    if not api_key:
-        raise RuntimeError("AI_API_KEY is not configured")
+_lock = threading.Lock()
+_endpoints: List["Endpoint"] = []
+_endpoints_key: Optional[Tuple[Any, ...]] = None
+_closing: Set[asyncio.Task] = set()
+_http2 = False
+_stats = {"clients_built": 0, "requests": 0}
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.upstream = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.upstream += 1
+        else:
+            self.coalesced += 1
+        self._waiters[key] += 1
+        try:
+            # Shielded so one caller giving up does not cancel the request for the others.
+            return await asyncio.shield(task)
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                if not self._waiters[key] and not task.done():
+                    self._forget(key, task)
+                    task.cancel()
+                    self.abandoned += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self.upstream,
+            "calls_saved": self.coalesced,
+            "abandoned": self.abandoned,
+        }
+
+
+_single_flight = SingleFlight()
+
+
+class Endpoint:
+    def __init__(self, provider: str, model: str, api_key: str, base_url: Optional[str]) -> None:
+        self.provider = provider
+        self.model = model
+        self.name = f"{provider}/{model}"
+        self.http_client = _build_http_client(_http2)
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client)
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.outcomes: Deque[bool] = deque(maxlen=OUTCOME_WINDOW)
+        self.open_until = 0.0
+        self.probing = False
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.json_mode = True
+
+    def state(self, now: float) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def available(self, now: float) -> bool:
+        state = self.state(now)
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def latency_quantile(self, quantile: float) -> Optional[float]:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * quantile), len(ordered) - 1)]
+
+    def hedge_delay(self) -> float:
+        observed = self.latency_quantile(settings.ai_hedge_quantile)
+        if observed is None:
+            return settings.ai_hedge_delay_ms / 1000
+        return max(observed, settings.ai_hedge_min_delay_ms / 1000)
 
+    def record(self, ok: bool, elapsed: float = 0.0) -> None:
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(elapsed)
+            if self.open_until:
+                logger.info("LLM provider %s recovered; closing its circuit", self.name)
+            self.open_until = 0.0
+            return
+        self.errors += 1
+        failures = self.outcomes.count(False)
+        tripped = self.state(time.monotonic()) == "half_open" or (
+            len(self.outcomes) >= settings.ai_circuit_min_calls
+            and failures / len(self.outcomes) >= settings.ai_circuit_error_rate
+        )
+        if tripped:
+            self.open_until = time.monotonic() + settings.ai_circuit_cooldown_seconds
+            self.outcomes.clear()
+            logger.warning(
+                "LLM provider %s is failing; ejecting it for %ss", self.name, settings.ai_circuit_cooldown_seconds
+            )
+
+    def record_censored(self, elapsed: float) -> None:
+        # A cancelled call only proves a lower bound. Below the hedge quantile it says nothing and
+        # would drag p95 down; above it, the endpoint really is slower than its window shows.
+        observed = self.latency_quantile(settings.ai_hedge_quantile)
+        if observed is not None and elapsed >= observed:
+            self.latencies.append(elapsed)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        p50 = self.latency_quantile(0.5)
+        p95 = self.latency_quantile(0.95)
+        recent = len(self.outcomes)
+        return {
+            "name": self.name,
+            "state": self.state(now),
+            "calls": self.calls,
+            "errors": self.errors,
+            "recent_error_rate": round(self.outcomes.count(False) / recent, 3) if recent else 0.0,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "json_mode": self.json_mode,
+        }
+
+
+def _resolve_base_url(provider: str, base_url: Optional[str]) -> Optional[str]:
     if provider == "groq":
         if not base_url:
             base_url = "https://api.groq.com/openai/v1"
@@ -22,7 +170,250 @@ def get_llm_client() -> Tuple[AsyncOpenAI, str]:
     if provider in {"openai", "groq", "openai-compatible"}:
         if provider != "openai" and not base_url:
             raise RuntimeError("AI_BASE_URL is required for this provider")
-        client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-        return client, settings.ai_model
+        return base_url
+
+    raise RuntimeError(f"Unsupported AI_PROVIDER: {provider}")
+
+
+def _provider_configs() -> List[Tuple[str, str, str, Optional[str]]]:
+    provider = settings.ai_provider.lower()
+    configs = [(provider, settings.ai_model, settings.ai_api_key, _resolve_base_url(provider, settings.ai_base_url or None))]
+    if settings.ai_providers:
+        try:
+            extra = json.loads(settings.ai_providers)
+        except json.JSONDecodeError as exc:
+            raise RuntimeError(f"AI_PROVIDERS is not valid JSON: {exc}") from exc
+        for entry in extra:
+            provider = entry.get("provider", "openai-compatible").lower()
+            configs.append(
+                (
+                    provider,
+                    entry.get("model") or settings.ai_model,
+                    entry.get("api_key") or settings.ai_api_key,
+                    _resolve_base_url(provider, entry.get("base_url") or None),
+                )
+            )
+    return configs
+
+
+def _http2_enabled() -> bool:
+    if not settings.ai_http2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("AI_HTTP2 is enabled but the h2 package is missing; using HTTP/1.1")
+        return False
+    return True
+
+
+async def _count_request(request: httpx.Request) -> None:
+    _stats["requests"] += 1
+
+
+def _build_http_client(http2: bool) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.ai_max_connections,
+            max_keepalive_connections=settings.ai_max_keepalive_connections,
+            keepalive_expiry=settings.ai_keepalive_seconds,
+        ),
+        timeout=httpx.Timeout(settings.ai_timeout, connect=10.0),
+        event_hooks={"request": [_count_request]},
+    )
+
+
+async def _close_after_timeout(http_client: httpx.AsyncClient) -> None:
+    # Let requests already running on the replaced client finish first.
+    await asyncio.sleep(settings.ai_timeout)
+    await http_client.aclose()
+
+
+def _close_later(http_client: httpx.AsyncClient) -> None:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_close_after_timeout(http_client))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def get_endpoints() -> List[Endpoint]:
+    global _endpoints, _endpoints_key, _http2
+    if not settings.ai_api_key:
+        raise RuntimeError("AI_API_KEY is not configured")
+
+    configs = _provider_configs()
+    key = (
+        tuple(configs),
+        settings.ai_http2,
+        settings.ai_max_connections,
+        settings.ai_max_keepalive_connections,
+        settings.ai_keepalive_seconds,
+        settings.ai_timeout,
+    )
+    with _lock:
+        if not _endpoints or _endpoints_key != key:
+            previous = _endpoints
+            _http2 = _http2_enabled()
+            _endpoints = [Endpoint(*config) for config in configs]
+            _endpoints_key = key
+            _stats["clients_built"] += 1
+            for endpoint in previous:
+                _close_later(endpoint.http_client)
+        return _endpoints
+
+
+def _candidates(payload: Optional[Dict[str, Any]] = None) -> List[Endpoint]:
+    endpoints = get_endpoints()
+    if payload and "response_format" in payload:
+        endpoints = [endpoint for endpoint in endpoints if endpoint.json_mode] or endpoints
+    now = time.monotonic()
+    healthy = [endpoint for endpoint in endpoints if endpoint.available(now)]
+    # With every circuit open, try them all rather than failing outright.
+    return healthy or sorted(endpoints, key=lambda endpoint: endpoint.open_until)
+
+
+def json_mode_available() -> bool:
+    return any(endpoint.json_mode for endpoint in get_endpoints())
+
+
+def json_mode_unsupported() -> List[str]:
+    with _lock:
+        return [endpoint.name for endpoint in _endpoints if not endpoint.json_mode]
+
+
+def _rejects_json_mode(exc: BaseException) -> bool:
+    # Other 400s (context length, content filters) are about this request, not the endpoint.
+    if not isinstance(exc, BadRequestError):
+        return False
+    if getattr(exc, "param", None) == "response_format":
+        return True
+    detail = str(exc).lower()
+    return "response_format" in detail or "json_object" in detail or "json mode" in detail
+
+
+def get_llm_client() -> Tuple[AsyncOpenAI, str]:
+    endpoint = _candidates()[0]
+    return endpoint.client, endpoint.model
+
+
+def _is_failover_error(exc: BaseException) -> bool:
+    if isinstance(exc, APIStatusError):
+        return exc.status_code >= 500 or exc.status_code in {408, 409, 429}
+    return True
+
+
+async def _call(endpoint: Endpoint, payload: Dict[str, Any]) -> Any:
+    if endpoint.state(time.monotonic()) == "half_open":
+        endpoint.probing = True
+    started = time.perf_counter()
+    try:
+        response = await endpoint.client.chat.completions.create(model=endpoint.model, **payload)
+    except asyncio.CancelledError:
+        endpoint.record_censored(time.perf_counter() - started)
+        raise
+    except Exception as exc:
+        if _is_failover_error(exc):
+            endpoint.record(False)
+        elif "response_format" in payload and _rejects_json_mode(exc):
+            endpoint.json_mode = False
+            logger.warning("JSON mode is not supported by %s (%s); skipping it for structured calls", endpoint.name, exc)
+        raise
+    finally:
+        endpoint.probing = False
+    endpoint.record(True, time.perf_counter() - started)
+    return response
+
+
+async def _routed_completion(payload: Dict[str, Any]) -> Any:
+    endpoints = _candidates(payload)
+    pending: Dict[asyncio.Task, Endpoint] = {}
+    hedged: Set[asyncio.Task] = set()
+    launched = 0
+    hedge_at = 0.0
+    error: Optional[BaseException] = None
+
+    def launch() -> None:
+        nonlocal launched, hedge_at
+        endpoint = endpoints[launched]
+        # The next hedge waits on the endpoint just launched, not on the primary.
+        hedge_at = time.monotonic() + endpoint.hedge_delay()
+        task = asyncio.ensure_future(_call(endpoint, payload))
+        if pending:
+            endpoint.hedges += 1
+            hedged.add(task)
+        pending[task] = endpoint
+        launched += 1
+
+    launch()
+    try:
+        while pending:
+            can_hedge = settings.ai_hedge_enabled and launched < len(endpoints)
+            timeout = max(hedge_at - time.monotonic(), 0.0) if can_hedge else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for task in done:
+                endpoint = pending.pop(task)
+                exc = task.exception()
+                if exc is None:
+                    if task in hedged:
+                        endpoint.hedge_wins += 1
+                    return task.result()
+                # A request error only ends the call once nothing else is in flight: a hedge
+                # that rejects the payload must not cancel a primary that would answer it.
+                if not _is_failover_error(exc) and not pending:
+                    raise exc
+                logger.warning("LLM provider %s failed: %s", endpoint.name, exc)
+                error = error or exc
+            if not pending and launched < len(endpoints):
+                launch()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def create_completion(**payload: Any) -> Any:
+    if not settings.ai_single_flight:
+        return await _routed_completion(payload)
+    body = json.dumps(payload, sort_keys=True, default=str)
+    key = hashlib.sha256(body.encode("utf-8")).hexdigest()
+    return await _single_flight.run(key, lambda: _routed_completion(payload))
+
+
+async def close_llm_client() -> None:
+    global _endpoints, _endpoints_key
+    with _lock:
+        endpoints = _endpoints
+        _endpoints, _endpoints_key = [], None
+    for endpoint in endpoints:
+        await endpoint.http_client.aclose()
+
 
-    raise RuntimeError(f"Unsupported AI_PROVIDER: {settings.ai_provider}")
+def llm_pool_stats() -> Dict[str, Any]:
+    with _lock:
+        endpoints = list(_endpoints)
+    now = time.monotonic()
+    connections = []
+    for endpoint in endpoints:
+        pool = getattr(endpoint.http_client._transport, "_pool", None)
+        connections.extend(getattr(pool, "connections", []))
+    return {
+        "http2": _http2,
+        "limits": {
+            "max_connections": settings.ai_max_connections,
+            "max_keepalive_connections": settings.ai_max_keepalive_connections,
+            "keepalive_seconds": settings.ai_keepalive_seconds,
+        },
+        **_stats,
+        "connections": {
+            "open": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle()),
+            "http2": sum(1 for connection in connections if "HTTP/2" in repr(connection)),
+        },
+        "single_flight": _single_flight.stats(),
+        "providers": [endpoint.stats(now) for endpoint in endpoints],
+    }
@@ -1,16 +1,31 @@
-import json
-import math
+import hashlib
+import heapq
+import itertools
 import os
 import re
+import threading
+import time
 import uuid
-from collections import Counter
+import zlib
+from contextlib import suppress
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 from pypdf import PdfReader
 from docx import Document
 
+from app.ai import kb_client, kb_store
+from app.ai.context import PackedContext, pack_context
+from app.ai.embeddings import Embedder, get_embedder
+from app.ai.kb_dense import DenseIndex, fit_centroids
+from app.ai.kb_index import InvertedIndex
+from app.ai.kb_segment import SegmentReader
+from app.ai.kb_store import SegmentStore, StoredChunk
 from app.config import settings
+from app.utils.cache import LRUCache
+
+APPEND_ATTEMPTS = 3
 
 
 @dataclass
@@ -20,50 +35,78 @@ class KnowledgeChunk:
     text: str
 
 
-def _ensure_storage() -> None:
-    os.makedirs(settings.kb_path, exist_ok=True)
-    index_path = os.path.join(settings.kb_path, "index.json")
-    if not os.path.exists(index_path):
-        with open(index_path, "w", encoding="utf-8") as handle:
-            json.dump({"documents": [], "chunks": []}, handle)
+_partitions: Dict[Tuple[str, str], "_Partition"] = {}
+_partitions_lock = threading.Lock()
+_last_sweep = 0.0
+_query_cache = LRUCache(settings.rag_cache_size)
+# Shared by every partition so a recreated partition never reuses a cached version.
+_index_versions = itertools.count(1)
 
 
-def _load_index() -> dict:
-    _ensure_storage()
-    index_path = os.path.join(settings.kb_path, "index.json")
-    with open(index_path, "r", encoding="utf-8") as handle:
-        return json.load(handle)
+def _iter_words(pieces: Iterable[str], max_length: int) -> Iterator[str]:
+    pending = ""
+    for piece in pieces:
+        raw = pending + piece
+        words = raw.split()
+        pending = words.pop() if words and not raw[-1].isspace() else ""
+        for word in words:
+            for start in range(0, len(word), max_length):
+                yield word[start : start + max_length]
+    for start in range(0, len(pending), max_length):
+        yield pending[start : start + max_length]
 
 
-def _save_index(index: dict) -> None:
-    index_path = os.path.join(settings.kb_path, "index.json")
-    with open(index_path, "w", encoding="utf-8") as handle:
-        json.dump(index, handle, ensure_ascii=False, indent=2)
+def _overlap_tail(text: str, overlap: int) -> str:
+    if len(text) <= overlap:
+        return text
+    start = len(text) - overlap
+    if text[start - 1] != " ":
+        start = text.find(" ", start) + 1
+        if start == 0:
+            return ""
+    return text[start:]
 
 
-def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
-    cleaned = " ".join(text.split())
-    chunks: List[str] = []
-    start = 0
-    while start < len(cleaned):
-        end = min(len(cleaned), start + chunk_size)
-        chunks.append(cleaned[start:end])
-        start = end - overlap
-        if start < 0:
-            start = 0
-        if end == len(cleaned):
-            break
-    return [chunk for chunk in chunks if chunk.strip()]
+def _iter_chunks(pieces: Iterable[str], chunk_size: int = 800, overlap: int = 100) -> Iterator[str]:
+    # Content-defined boundaries: a cut depends only on the neighbouring words, so editing one
+    # passage changes the chunks around it while the rest of the document keeps its chunk ids.
+    min_size = chunk_size // 2
+    max_size = chunk_size * 3 // 2
+    divisor = max((chunk_size - min_size) // 6, 1)
+    body: List[str] = []
+    size = -1
+    previous = ""
+    tail = ""
+    for word in _iter_words(pieces, max_size):
+        body.append(word)
+        size += len(word) + 1
+        boundary = size >= max_size or (
+            size >= min_size and zlib.crc32(f"{previous} {word}".encode("utf-8")) % divisor == 0
+        )
+        previous = word
+        if boundary:
+            text = " ".join(body)
+            yield f"{tail} {text}" if tail else text
+            tail = _overlap_tail(text, overlap)
+            body = []
+            size = -1
+    if body:
+        text = " ".join(body)
+        yield f"{tail} {text}" if tail else text
 
 
-def _extract_text(file_path: str, filename: str) -> str:
+def _iter_text(file_path: str, filename: str, block_size: int = 65536) -> Iterator[str]:
     lower = filename.lower()
     if lower.endswith(".pdf"):
         reader = PdfReader(file_path)
-        return "\n".join(page.extract_text() or "" for page in reader.pages)
+        for page in reader.pages:
+            yield (page.extract_text() or "") + "\n"
+        return
     if lower.endswith(".docx"):
         doc = Document(file_path)
-        return "\n".join(paragraph.text for paragraph in doc.paragraphs)
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n"
+        return
     if lower.endswith((".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff")):
         try:
             from PIL import Image
@@ -75,38 +118,376 @@ def _extract_text(file_path: str, filename: str) -> str:
             raise RuntimeError("Image OCR requires pytesseract and tesseract.") from exc
         try:
             with Image.open(file_path) as image:
-                return pytesseract.image_to_string(image)
+                text = pytesseract.image_to_string(image)
         except Exception as exc:  # pragma: no cover
             raise RuntimeError("Tesseract OCR is not available. Install tesseract and ensure it is on PATH.") from exc
+        yield text
+        return
     with open(file_path, "r", encoding="utf-8", errors="ignore") as handle:
-        return handle.read()
+        while True:
+            block = handle.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+def _embed_segment(reader: SegmentReader, embedder: Embedder, batch_size: int = 256) -> np.ndarray:
+    vectors = np.empty((len(reader), embedder.dim), dtype=np.float32)
+    for start in range(0, len(reader), batch_size):
+        stop = min(start + batch_size, len(reader))
+        vectors[start:stop] = embedder.embed([reader.text(row) for row in range(start, stop)])
+    return vectors
+
+
+def _write_embeddings(segment_path: str) -> None:
+    if settings.rag_dense_weight <= 0:
+        return
+    embedder = get_embedder()
+    reader = SegmentReader(segment_path)
+    try:
+        vectors = _embed_segment(reader, embedder)
+    finally:
+        reader.close()
+    kb_store.save_companion(kb_store.companion_path(segment_path, embedder.key), vectors)
+
+
+def _segment_vectors(store: SegmentStore, segment: str) -> Optional[np.ndarray]:
+    reader = store.reader(segment)
+    if reader is None:
+        return None
+    embedder = get_embedder()
+    path = kb_store.companion_path(store.segment_path(segment), embedder.key)
+    try:
+        vectors = np.load(path, mmap_mode="r")
+        if vectors.shape == (len(reader), embedder.dim):
+            return vectors
+    except (OSError, ValueError):
+        pass
+    vectors = _embed_segment(reader, embedder)
+    kb_store.save_companion(path, vectors)
+    return vectors
+
+
+def _add_dense(dense: DenseIndex, store: SegmentStore, segment: str, items: List[Tuple[str, int]]) -> None:
+    vectors = _segment_vectors(store, segment)
+    if vectors is None or not items:
+        return
+    dense.add([chunk_id for chunk_id, _ in items], np.asarray(vectors[[row for _, row in items]]))
+
+
+def _tenant(tenant_id: Optional[str]) -> str:
+    return tenant_id or settings.default_tenant_id
+
+
+def kb_root(tenant_id: Optional[str] = None) -> str:
+    tenant = _tenant(tenant_id)
+    if tenant == settings.default_tenant_id:
+        return settings.kb_path
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", tenant):
+        tenant = hashlib.sha1(tenant.encode("utf-8")).hexdigest()
+    return os.path.join(settings.kb_path, "tenants", tenant)
+
+
+class _Partition:
+    def __init__(self, tenant_id: str, root: str) -> None:
+        self.tenant_id = tenant_id
+        self.root = root
+        self.lock = threading.RLock()
+        self.store = SegmentStore(root)
+        self.index: Optional[InvertedIndex] = None
+        self.dense: Optional[DenseIndex] = None
+        self.config: Optional[str] = None
+        self.synced_stamp: Optional[Tuple[int, int]] = None
+        self.indexed_versions: Dict[str, int] = {}
+        self.syncing: Set[str] = set()
+        self.version = next(_index_versions)
+        self.ann_training = False
+        self.last_used = time.monotonic()
+
+    def _ann_path(self) -> str:
+        return os.path.join(self.root, f"ann.{get_embedder().key}.npz")
+
+    def get_index(self) -> InvertedIndex:
+        with self.lock:
+            dense_key = get_embedder().key if settings.rag_dense_weight > 0 else None
+            if self.index is None or self.config != dense_key:
+                search_index = InvertedIndex(
+                    proximity_window=settings.rag_proximity_window, max_edits=settings.rag_fuzzy_max_edits
+                )
+                dense = DenseIndex(get_embedder().dim) if dense_key else None
+                self.synced_stamp = self.store.stamp()
+                self.indexed_versions = self._document_versions()
+                by_segment: Dict[str, List[Tuple[str, int]]] = {}
+                for chunk in self.store.iter_chunks():
+                    fresh = chunk.chunk_id not in search_index
+                    search_index.add(chunk.chunk_id, chunk.doc_id, _tokenize(chunk.text) if fresh else [])
+                    if fresh:
+                        by_segment.setdefault(chunk.segment, []).append((chunk.chunk_id, chunk.row))
+                if dense is not None:
+                    for segment, items in by_segment.items():
+                        _add_dense(dense, self.store, segment, items)
+                    if len(dense) >= settings.rag_ann_min_chunks > 0:
+                        loaded = dense.load_ann(self._ann_path())
+                        if not loaded or dense.needs_training(settings.rag_ann_min_chunks):
+                            dense.train(settings.rag_ann_nlist)
+                        if dense.unsaved:
+                            dense.save_ann(self._ann_path())
+                self.index = search_index
+                self.dense = dense
+                self.config = dense_key
+                self.version = next(_index_versions)
+            elif self.store.stamp() != self.synced_stamp:
+                self._refresh()
+            return self.index
+
+    def _document_versions(self) -> Dict[str, int]:
+        return {doc["id"]: doc["version"] for doc in self.store.documents()}
+
+    def _refresh(self) -> None:
+        # Another process (or the retrieval service fallback) changed the manifest.
+        self.synced_stamp = self.store.stamp()
+        current = self._document_versions()
+        changed = False
+        for doc_id in [doc_id for doc_id in self.indexed_versions if doc_id not in current]:
+            changed |= self._drop_document(doc_id)
+        for doc_id, version in current.items():
+            # index_document tokenises those outside the lock; syncing them here would not.
+            if doc_id in self.syncing:
+                continue
+            if self.indexed_versions.get(doc_id) != version:
+                changed |= self._sync_document(doc_id, list(self.store.iter_document(doc_id)), {})
+                self.indexed_versions[doc_id] = version
+        if changed:
+            self.version = next(_index_versions)
+
+    def _drop_document(self, doc_id: str) -> bool:
+        self.indexed_versions.pop(doc_id, None)
+        removed = self.index.remove_document(doc_id)
+        if self.dense is not None:
+            self.dense.remove(removed)
+        return bool(removed)
+
+    def _sync_document(self, doc_id: str, chunks: List[StoredChunk], tokenized: Dict[str, List[str]]) -> bool:
+        search_index = self.index
+        indexed = set(search_index.document_chunks(doc_id))
+        wanted = {chunk.chunk_id for chunk in chunks}
+        removed = search_index.remove_from_document(doc_id, list(indexed - wanted))
+        added = [chunk for chunk in chunks if chunk.chunk_id not in indexed]
+        for chunk in added:
+            tokens = tokenized.get(chunk.chunk_id)
+            search_index.add(chunk.chunk_id, doc_id, tokens if tokens is not None else _tokenize(chunk.text))
+        if self.dense is not None:
+            self.dense.remove(removed)
+            by_segment: Dict[str, List[Tuple[str, int]]] = {}
+            for chunk in added:
+                by_segment.setdefault(chunk.segment, []).append((chunk.chunk_id, chunk.row))
+            for segment, items in by_segment.items():
+                _add_dense(self.dense, self.store, segment, items)
+            if added:
+                self._maintain_ann(self.dense)
+        return bool(added or removed)
+
+    def _train_ann(self, dense: DenseIndex) -> None:
+        try:
+            with self.lock:
+                sample = dense.sample()
+                total = len(dense)
+            centroids = fit_centroids(sample, total, settings.rag_ann_nlist)
+            with self.lock:
+                dense.install_centroids(centroids)
+                dense.save_ann(self._ann_path())
+        finally:
+            self.ann_training = False
+
+    def _maintain_ann(self, dense: DenseIndex) -> None:
+        if dense.needs_training(settings.rag_ann_min_chunks):
+            if not self.ann_training:
+                self.ann_training = True
+                threading.Thread(target=self._train_ann, args=(dense,), name="kb-ann-train", daemon=True).start()
+        elif dense.has_ann and dense.unsaved > max(1000, len(dense) // 20):
+            dense.save_ann(self._ann_path())
+
+    def index_document(self, doc_id: str) -> None:
+        version = self._document_versions().get(doc_id)
+        chunks = list(self.store.iter_document(doc_id))
+        with self.lock:
+            self.syncing.add(doc_id)
+        try:
+            with self.lock:
+                indexed = set(self.get_index().document_chunks(doc_id))
+            tokenized = {chunk.chunk_id: _tokenize(chunk.text) for chunk in chunks if chunk.chunk_id not in indexed}
+            with self.lock:
+                self.get_index()
+                if self._sync_document(doc_id, chunks, tokenized):
+                    self.version = next(_index_versions)
+                if version is None:
+                    self.indexed_versions.pop(doc_id, None)
+                else:
+                    self.indexed_versions[doc_id] = version
+        finally:
+            with self.lock:
+                self.syncing.discard(doc_id)
+        # Appends go through kb_store.append_document, so the segment count is checked here.
+        self.store.maybe_compact()
+
+    def delete_document(self, doc_id: str) -> None:
+        with self.lock:
+            self.get_index()
+            self.store.delete_document(doc_id)
+            self._drop_document(doc_id)
+            self.version = next(_index_versions)
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        query_tokens = _tokenize(query)
+        if not query_tokens:
+            return []
+        with self.lock:
+            self.get_index()
+            # Token order matters to the phrase bonus, and the dense layer embeds the raw query.
+            raw = " ".join(query.lower().split()) if self.dense is not None and len(self.dense) else None
+            key = (self.root, self.version, limit, tuple(query_tokens), raw)
+        cached = _query_cache.get(key)
+        if cached is not None:
+            return cached
+        hits = self._rank(query, query_tokens, limit)
+        _query_cache.put(key, hits)
+        return hits
+
+    def _rank(self, query: str, query_tokens: List[str], limit: int) -> List[Tuple[str, float]]:
+        with self.lock:
+            search_index = self.get_index()
+            dense = self.dense
+            if dense is None or not len(dense):
+                return search_index.search(query_tokens, limit)
+            lexical = search_index.search(query_tokens, limit * 4)
+            query_vector = get_embedder().embed([query])[0]
+            similarities = dense.similarity(query_vector, [chunk_id for chunk_id, _ in lexical])
+            weight = settings.rag_dense_weight
+            top_lexical = lexical[0][1] if lexical else 1.0
+            fused: Dict[str, float] = {}
+            for chunk_id, score in lexical:
+                similarity = max(similarities.get(chunk_id, 0.0), 0.0)
+                fused[chunk_id] = (1 - weight) * score / top_lexical + weight * similarity
+            for chunk_id, similarity in dense.search(query_vector, limit * 4, settings.rag_ann_nprobe):
+                if chunk_id not in fused and similarity >= settings.rag_dense_min_score:
+                    fused[chunk_id] = weight * similarity
+        return heapq.nlargest(limit, fused.items(), key=lambda item: item[1])
 
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "tenant_id": self.tenant_id,
+                "index_version": self.version,
+                "chunks": len(self.index) if self.index is not None else 0,
+                "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            }
 
-def ingest_document(filename: str, file_path: str) -> dict:
-    index = _load_index()
-    doc_id = uuid.uuid4().hex
-    text = _extract_text(file_path, filename)
-    chunks = _chunk_text(text)
-    chunk_entries = []
+
+def _sweep_partitions(now: float) -> None:
+    global _last_sweep
+    if now - _last_sweep < 60:
+        return
+    _last_sweep = now
+    idle = [
+        key
+        for key, partition in _partitions.items()
+        if now - partition.last_used > settings.kb_idle_seconds and not partition.ann_training
+    ]
+    for key in idle:
+        del _partitions[key]
+    overflow = len(_partitions) - max(settings.kb_max_active_tenants, 1)
+    if overflow > 0:
+        coldest = sorted(_partitions, key=lambda key: _partitions[key].last_used)[:overflow]
+        for key in coldest:
+            del _partitions[key]
+
+
+def _get_partition(tenant_id: Optional[str] = None) -> _Partition:
+    tenant = _tenant(tenant_id)
+    key = (tenant, kb_root(tenant))
+    now = time.monotonic()
+    with _partitions_lock:
+        _sweep_partitions(now)
+        partition = _partitions.get(key)
+        if partition is None:
+            partition = _Partition(tenant, key[1])
+            _partitions[key] = partition
+        partition.last_used = now
+        return partition
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id_for(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _unique_chunks(chunks: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    seen = set()
     for chunk in chunks:
-        chunk_entries.append({"id": uuid.uuid4().hex, "doc_id": doc_id, "text": chunk})
+        chunk_id = chunk_id_for(chunk)
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            yield chunk_id, chunk
+
+
+def build_document(root: str, filename: str, file_path: str, sha256: Optional[str] = None) -> dict:
+    document = {"id": uuid.uuid4().hex, "filename": filename, "sha256": sha256 or file_sha256(file_path)}
+    for attempt in range(APPEND_ATTEMPTS):
+        chunks = _unique_chunks(_iter_chunks(_iter_text(file_path, filename)))
+        try:
+            return kb_store.append_document(root, document, chunks, _write_embeddings)
+        except kb_store.CompactedDuringAppend:
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+
+
+def _service(op: str, **params) -> Any:
+    return kb_client.request(settings.rag_service_socket, op, params)
 
-    index["documents"].append({"id": doc_id, "filename": filename, "chunks": len(chunk_entries)})
-    index["chunks"].extend(chunk_entries)
-    _save_index(index)
-    return {"id": doc_id, "filename": filename, "chunks": len(chunk_entries)}
 
+def find_document_by_hash(sha256: str, tenant_id: Optional[str] = None) -> Optional[dict]:
+    if settings.rag_service_socket:
+        with suppress(kb_client.ServiceUnavailable):
+            return _service("find", sha256=sha256, tenant_id=tenant_id)
+    return _get_partition(tenant_id).store.find_document(sha256)
 
-def list_documents() -> List[dict]:
-    index = _load_index()
-    return index.get("documents", [])
 
+def index_document(doc_id: str, tenant_id: Optional[str] = None) -> None:
+    if settings.rag_service_socket:
+        # The document is already in the manifest; the service picks it up from there once it is back.
+        with suppress(kb_client.ServiceUnavailable):
+            _service("index", doc_id=doc_id, tenant_id=tenant_id)
+        return
+    _get_partition(tenant_id).index_document(doc_id)
 
-def delete_document(doc_id: str) -> None:
-    index = _load_index()
-    index["documents"] = [doc for doc in index.get("documents", []) if doc["id"] != doc_id]
-    index["chunks"] = [chunk for chunk in index.get("chunks", []) if chunk["doc_id"] != doc_id]
-    _save_index(index)
+
+def ingest_document(filename: str, file_path: str, tenant_id: Optional[str] = None) -> dict:
+    os.makedirs(kb_root(tenant_id), exist_ok=True)
+    document = build_document(kb_root(tenant_id), filename, file_path)
+    if not document["duplicate"]:
+        index_document(document["id"], tenant_id)
+    return document
+
+
+def list_documents(tenant_id: Optional[str] = None) -> List[dict]:
+    if settings.rag_service_socket:
+        with suppress(kb_client.ServiceUnavailable):
+            return _service("documents", tenant_id=tenant_id)
+    return _get_partition(tenant_id).store.documents()
+
+
+def delete_document(doc_id: str, tenant_id: Optional[str] = None) -> None:
+    if settings.rag_service_socket:
+        # Not applied locally: the service would keep serving the document from its own index.
+        return _service("delete", doc_id=doc_id, tenant_id=tenant_id)
+    _get_partition(tenant_id).delete_document(doc_id)
 
 
 _STOP_WORDS = {
@@ -149,49 +530,31 @@ def _tokenize(text: str) -> List[str]:
     return [token for token in tokens if len(token) > 2 and token not in _STOP_WORDS]
 
 
-def _score_chunk(query_tokens: List[str], text: str, idf: Dict[str, float]) -> float:
-    if not query_tokens:
-        return 0.0
-    text_tokens = _tokenize(text)
-    if not text_tokens:
-        return 0.0
-    tf = Counter(text_tokens)
-    score = 0.0
-    for token in query_tokens:
-        if token in tf:
-            score += tf[token] * idf.get(token, 1.0)
-    phrase = " ".join(query_tokens)
-    if phrase and phrase in text.lower():
-        score += 2.0
-    return score
-
-
-def retrieve_context(query: str) -> str:
-    index = _load_index()
-    chunks = index.get("chunks", [])
-    if not chunks:
-        return ""
-    query_tokens = _tokenize(query)
-    if not query_tokens:
-        return ""
-    total_chunks = len(chunks)
-    doc_freq: Dict[str, int] = {token: 0 for token in query_tokens}
-    for chunk in chunks:
-        chunk_tokens = set(_tokenize(chunk.get("text", "")))
-        for token in query_tokens:
-            if token in chunk_tokens:
-                doc_freq[token] += 1
-    idf = {token: math.log((total_chunks + 1) / (doc_freq[token] + 1)) + 1 for token in query_tokens}
-    scored = sorted(
-        chunks,
-        key=lambda chunk: _score_chunk(query_tokens, chunk.get("text", ""), idf),
-        reverse=True,
-    )
-    top = [
-        chunk
-        for chunk in scored
-        if _score_chunk(query_tokens, chunk.get("text", ""), idf) > 0
-    ][: settings.rag_top_k]
-    if not top:
-        return ""
-    return "\n\n".join(chunk["text"] for chunk in top)
+def search_knowledge_base_hits(query: str, limit: int, tenant_id: Optional[str] = None) -> List[Tuple[str, float]]:
+    if settings.rag_service_socket:
+        with suppress(kb_client.ServiceUnavailable):
+            return [(text, score) for text, score in _service("search", query=query, limit=limit, tenant_id=tenant_id)]
+    partition = _get_partition(tenant_id)
+    hits = [(partition.store.text(chunk_id), score) for chunk_id, score in partition.search(query, limit)]
+    return [(text, score) for text, score in hits if text]
+
+
+def search_knowledge_base(query: str, tenant_id: Optional[str] = None) -> List[str]:
+    return [text for text, _ in search_knowledge_base_hits(query, settings.rag_top_k, tenant_id)]
+
+
+def pack_knowledge_context(query: str, budget: int, tenant_id: Optional[str] = None) -> PackedContext:
+    return pack_context(search_knowledge_base_hits(query, settings.rag_top_k * 2, tenant_id), budget)
+
+
+def retrieve_context(query: str, tenant_id: Optional[str] = None) -> str:
+    return pack_knowledge_context(query, settings.rag_context_tokens, tenant_id).text
+
+
+def retrieval_cache_stats() -> dict:
+    if settings.rag_service_socket:
+        with suppress(kb_client.ServiceUnavailable):
+            return {**_service("stats"), "service": settings.rag_service_socket}
+    with _partitions_lock:
+        partitions = [partition.stats() for partition in _partitions.values()]
+    return {**_query_cache.stats(), "active_tenants": len(partitions), "tenants": partitions}
@@ -0,0 +1,147 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from app.ai.embeddings import get_embedder
+from app.config import settings
+
+
+class _Entry(NamedTuple):
+    reply: str
+    expires: float
+    scope: str
+    vector: Optional[np.ndarray]
+
+
+def normalize_message(message: str) -> str:
+    return " ".join(re.findall(r"\w+", message.lower()))
+
+
+def prompt_fingerprint(model: str, messages: List[Dict[str, str]]) -> str:
+    # Everything but the final user turn: the system prompt, retrieved context and the
+    # conversation so far. A short reply like "yes" only matches within the same thread state.
+    digest = hashlib.sha1(model.encode("utf-8"))
+    for item in messages[:-1]:
+        digest.update(b"\0" + item["role"].encode("utf-8") + b"\0" + item["content"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, capacity: int, ttl_seconds: float, semantic_threshold: float) -> None:
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._scopes: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+        self._tenants: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+
+    def _count(self, tenant_id: str, outcome: str) -> None:
+        counts = self._tenants.setdefault(tenant_id, {"exact_hits": 0, "semantic_hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key)
+        keys = self._scopes.get(entry.scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[entry.scope]
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        if self.semantic_threshold <= 0 or not text:
+            return None
+        return get_embedder().embed([text])[0]
+
+    def _semantic_match(self, scope: str, vector: np.ndarray, now: float) -> Optional[Tuple[str, str]]:
+        candidates = [key for key in self._scopes.get(scope, ()) if self._entries[key].vector is not None]
+        if not candidates:
+            return None
+        matrix = np.stack([self._entries[key].vector for key in candidates])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        key = candidates[best]
+        if scores[best] < self.semantic_threshold or self._entries[key].expires <= now:
+            return None
+        return key
+
+    def get(self, tenant_id: str, scope: str, message: str) -> Optional[str]:
+        if self.capacity <= 0:
+            return None
+        text = normalize_message(message)
+        vector = self._embed(text)
+        now = time.monotonic()
+        with self._lock:
+            key = (scope, text)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= now:
+                self._drop(key)
+                entry = None
+            outcome = "exact_hits"
+            if entry is None and vector is not None:
+                key = self._semantic_match(scope, vector, now)
+                entry = self._entries[key] if key else None
+                outcome = "semantic_hits"
+            if entry is None:
+                self._count(tenant_id, "misses")
+                return None
+            self._entries.move_to_end(key)
+            self._count(tenant_id, outcome)
+            return entry.reply
+
+    def put(self, scope: str, message: str, reply: str) -> None:
+        if self.capacity <= 0 or not reply:
+            return
+        text = normalize_message(message)
+        entry = _Entry(reply, time.monotonic() + self.ttl_seconds, scope, self._embed(text))
+        with self._lock:
+            key = (scope, text)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.capacity:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tenants = {}
+            for tenant_id, counts in self._tenants.items():
+                hits = counts["exact_hits"] + counts["semantic_hits"]
+                lookups = hits + counts["misses"]
+                tenants[tenant_id] = {**counts, "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "ttl_seconds": self.ttl_seconds,
+                "semantic_threshold": self.semantic_threshold,
+                "evictions": self.evictions,
+                "tenants": tenants,
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_config: Optional[tuple] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache, _cache_config
+    config = (settings.ai_cache_size, settings.ai_cache_ttl_seconds, settings.ai_cache_semantic_threshold)
+    with _cache_lock:
+        if _cache is None or _cache_config != config:
+            _cache = ResponseCache(*config)
+            _cache_config = config
+        return _cache
@@ -13,6 +13,32 @@ class Settings:
         self.ai_api_key = os.getenv("AI_API_KEY", "")
         self.ai_base_url = os.getenv("AI_BASE_URL", "")
         self.ai_model = os.getenv("AI_MODEL", "gpt-4o-mini")
+        self.ai_timeout = float(os.getenv("AI_TIMEOUT", "60"))
+        self.ai_http2 = os.getenv("AI_HTTP2", "true").lower() in {"1", "true", "yes"}
+        self.ai_max_connections = int(os.getenv("AI_MAX_CONNECTIONS", "100"))
+        self.ai_max_keepalive_connections = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.ai_keepalive_seconds = float(os.getenv("AI_KEEPALIVE_SECONDS", "30"))
+        self.ai_providers = os.getenv("AI_PROVIDERS", "")
+        self.ai_hedge_enabled = os.getenv("AI_HEDGE_ENABLED", "true").lower() in {"1", "true", "yes"}
+        self.ai_hedge_quantile = float(os.getenv("AI_HEDGE_QUANTILE", "0.95"))
+        self.ai_hedge_delay_ms = float(os.getenv("AI_HEDGE_DELAY_MS", "2000"))
+        self.ai_hedge_min_delay_ms = float(os.getenv("AI_HEDGE_MIN_DELAY_MS", "250"))
+        self.ai_circuit_min_calls = int(os.getenv("AI_CIRCUIT_MIN_CALLS", "5"))
+        self.ai_circuit_error_rate = float(os.getenv("AI_CIRCUIT_ERROR_RATE", "0.5"))
+        self.ai_circuit_cooldown_seconds = float(os.getenv("AI_CIRCUIT_COOLDOWN_SECONDS", "30"))
+        self.ai_single_flight = os.getenv("AI_SINGLE_FLIGHT", "true").lower() in {"1", "true", "yes"}
+        self.ai_cache_size = int(os.getenv("AI_CACHE_SIZE", "1000"))
+        self.ai_cache_ttl_seconds = float(os.getenv("AI_CACHE_TTL_SECONDS", "3600"))
+        self.ai_cache_semantic_threshold = float(os.getenv("AI_CACHE_SEMANTIC_THRESHOLD", "0"))
+        self.ai_history_messages = int(os.getenv("AI_HISTORY_MESSAGES", "6"))
+        self.ai_summary_batch = int(os.getenv("AI_SUMMARY_BATCH", "4"))
+        self.ai_summary_tokens = int(os.getenv("AI_SUMMARY_TOKENS", "200"))
+        self.lang_detect_model = os.getenv("LANG_DETECT_MODEL", "")
+        self.lang_detect_min_chars = int(os.getenv("LANG_DETECT_MIN_CHARS", "20"))
+        self.lang_detect_confidence = float(os.getenv("LANG_DETECT_CONFIDENCE", "0.8"))
+        self.lang_switch_min_chars = int(os.getenv("LANG_SWITCH_MIN_CHARS", "40"))
+        self.lang_switch_confidence = float(os.getenv("LANG_SWITCH_CONFIDENCE", "0.95"))
+        self.ai_reply_mode = os.getenv("AI_REPLY_MODE", "structured").lower()
         self.verify_token = os.getenv("VERIFY_TOKEN", "")
         self.database_url = os.getenv("DATABASE_URL", "")
         if self.database_url:
@@ -37,6 +63,27 @@ class Settings:
             "WORKFLOW_RULES_PATH", os.path.join(os.getcwd(), "data", "workflows.json")
         )
         self.rag_top_k = int(os.getenv("RAG_TOP_K", "4"))
+        self.rag_prompt_tokens = int(os.getenv("RAG_PROMPT_TOKENS", "3000"))
+        self.rag_prompt_budgets = os.getenv("RAG_PROMPT_BUDGETS", "")
+        self.rag_context_tokens = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+        self.rag_context_min_score_ratio = float(os.getenv("RAG_CONTEXT_MIN_SCORE_RATIO", "0.35"))
+        self.rag_proximity_window = int(os.getenv("RAG_PROXIMITY_WINDOW", "8"))
+        self.rag_fuzzy_max_edits = int(os.getenv("RAG_FUZZY_MAX_EDITS", "2"))
+        self.rag_embedder = os.getenv("RAG_EMBEDDER", "hashing")
+        self.rag_embedding_dim = int(os.getenv("RAG_EMBEDDING_DIM", "256"))
+        self.rag_dense_weight = float(os.getenv("RAG_DENSE_WEIGHT", "0.35"))
+        self.rag_dense_min_score = float(os.getenv("RAG_DENSE_MIN_SCORE", "0.4"))
+        self.rag_ann_min_chunks = int(os.getenv("RAG_ANN_MIN_CHUNKS", "50000"))
+        self.rag_ann_nlist = int(os.getenv("RAG_ANN_NLIST", "0"))
+        self.rag_ann_nprobe = int(os.getenv("RAG_ANN_NPROBE", "8"))
+        self.rag_cache_size = int(os.getenv("RAG_CACHE_SIZE", "1024"))
+        self.rag_service_socket = os.getenv("RAG_SERVICE_SOCKET", "")
+        self.rag_service_timeout = float(os.getenv("RAG_SERVICE_TIMEOUT", "5"))
+        self.kb_idle_seconds = int(os.getenv("KB_IDLE_SECONDS", "900"))
+        self.kb_max_active_tenants = int(os.getenv("KB_MAX_ACTIVE_TENANTS", "64"))
+        self.kb_max_upload_mb = int(os.getenv("KB_MAX_UPLOAD_MB", "25"))
+        self.kb_max_bulk_upload_mb = int(os.getenv("KB_MAX_BULK_UPLOAD_MB", "200"))
+        self.kb_ingest_workers = int(os.getenv("KB_INGEST_WORKERS", "2"))
         self.twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID", "")
         self.twilio_auth_token = os.getenv("TWILIO_AUTH_TOKEN", "")
         self.twilio_from_number = os.getenv("TWILIO_FROM_NUMBER", "")
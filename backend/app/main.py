@@ -6,6 +6,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
+from app.config import settings
 from app.routes.web_chat import router as web_chat_router
 from app.routes.whatsapp import router as whatsapp_router
 from app.routes.messenger import router as messenger_router
@@ -14,6 +15,10 @@ from app.routes.instagram import router as instagram_router
 from app.routes.admin import router as admin_router
 from app.routes.auth import router as auth_router
 from app.services.db import get_analytics, init_db
+from app.services.ingest_jobs import shutdown_ingest_pool
+from app.ai.provider import close_llm_client
+from app.ai.language import warm_up as warm_up_language_detector
+from app.utils.uploads import request_limit_status
 
 app = FastAPI(title="AI Multi-Channel Chatbot", version="0.1.0")
 
@@ -41,6 +46,27 @@ async def rate_limit_middleware(request: Request, call_next):
     _rate_state[ip] = timestamps
     return await call_next(request)
 
+
+_UPLOAD_LIMITS_MB = {
+    "/admin/knowledge-base/upload": lambda: settings.kb_max_upload_mb,
+    "/admin/knowledge-base/bulk-upload": lambda: settings.kb_max_bulk_upload_mb,
+}
+_UPLOAD_ERRORS = {
+    400: "Invalid Content-Length",
+    411: "Content-Length is required for uploads",
+    413: "Upload exceeds the size limit",
+}
+
+
+@app.middleware("http")
+async def upload_limit_middleware(request: Request, call_next):
+    limit_mb = _UPLOAD_LIMITS_MB.get(request.url.path)
+    if limit_mb is not None and request.method == "POST":
+        status = request_limit_status(request.headers.get("content-length"), limit_mb() * 1024 * 1024)
+        if status is not None:
+            return JSONResponse(status_code=status, content={"detail": _UPLOAD_ERRORS[status]})
+    return await call_next(request)
+
 @app.get("/health")
 async def health() -> dict:
     return {"status": "ok"}
@@ -48,6 +74,13 @@ async def health() -> dict:
 @app.on_event("startup")
 async def on_startup() -> None:
     await init_db()
+    await asyncio.to_thread(warm_up_language_detector)
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    shutdown_ingest_pool()
+    await close_llm_client()
 
 app.include_router(web_chat_router, prefix="/webchat", tags=["webchat"])
 app.include_router(whatsapp_router, prefix="/whatsapp", tags=["whatsapp"])
@@ -146,6 +146,25 @@ class KnowledgeBaseDoc(BaseModel):
     id: str
     filename: str
     chunks: int
+    version: int = 1
+    duplicate: bool = False
+
+class IngestFileStatus(BaseModel):
+    filename: str
+    status: str
+    document: Optional[KnowledgeBaseDoc] = None
+    error: Optional[str] = None
+
+class IngestJobView(BaseModel):
+    id: str
+    status: str
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    total: int
+    completed: int
+    failed: int
+    duplicates: int = 0
+    files: List[IngestFileStatus]
 
 class KnowledgeBaseSearchRequest(BaseModel):
     query: str
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import Any, Dict, List, Optional
 
@@ -21,6 +22,7 @@ from app.models.schemas import (
     FlowUpdate,
     FlowView,
     HandoffUpdate,
+    IngestJobView,
     IntelligenceRequest,
     IntelligenceResponse,
     KnowledgeBaseDoc,
@@ -36,7 +38,15 @@ from app.models.schemas import (
     WorkflowRule,
     WorkflowRulesUpdate,
 )
-from app.ai.rag import delete_document, ingest_document, list_documents, retrieve_context
+from app.ai.rag import (
+    delete_document,
+    find_document_by_hash,
+    kb_root,
+    list_documents,
+    retrieval_cache_stats,
+    search_knowledge_base,
+)
+from app.services.ingest_jobs import get_ingest_job, ingest_file, start_ingest_job
 from app.services.flows import create_flow, delete_flow, list_flows, save_flows
 from app.services.intelligence import classify_intent, extract_entities, summarize, summarize_conversation, suggest_responses
 from app.services.email import send_email
@@ -56,7 +66,12 @@ from app.services.db import (
     add_message,
 )
 from app.services.env import update_env_file
-from app.ai.chatbot import generate_reply
+from app.ai.chatbot import generate_reply, reply_path_stats
+from app.ai.kb_client import ServiceUnavailable
+from app.ai.context import prompt_usage_stats
+from app.ai.provider import llm_pool_stats
+from app.ai.response_cache import get_response_cache
+from app.utils.uploads import UploadTooLarge, discard_upload, keep_upload, save_upload
 from app.services.messaging import (
     send_instagram_message,
     send_messenger_message,
@@ -237,43 +252,93 @@ async def update_settings(payload: SettingsUpdate, tenant_id: str = Depends(get_
     return await get_settings()
 
 @router.post("/email/reply", response_model=EmailReplyResponse, dependencies=[Depends(require_admin_key)])
-async def email_reply(payload: EmailReplyRequest) -> EmailReplyResponse:
-    reply, _ = await generate_reply(payload.message, channel="email", history=[])
+async def email_reply(payload: EmailReplyRequest, tenant_id: str = Depends(get_tenant_id)) -> EmailReplyResponse:
+    reply, _ = await generate_reply(payload.message, channel="email", history=[], tenant_id=tenant_id)
     send_email(payload.to, payload.subject, reply)
     return EmailReplyResponse(reply=reply)
 
 
 @router.post("/knowledge-base/upload", response_model=KnowledgeBaseDoc, dependencies=[Depends(require_admin_key)])
-async def upload_kb(file: UploadFile = File(...)) -> KnowledgeBaseDoc:
-    os.makedirs(settings.kb_path, exist_ok=True)
-    file_path = os.path.join(settings.kb_path, file.filename)
-    with open(file_path, "wb") as handle:
-        handle.write(await file.read())
+async def upload_kb(file: UploadFile = File(...), tenant_id: str = Depends(get_tenant_id)) -> KnowledgeBaseDoc:
+    try:
+        upload = await save_upload(file, kb_root(tenant_id), settings.kb_max_upload_mb * 1024 * 1024)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    existing = await asyncio.to_thread(find_document_by_hash, upload.sha256, tenant_id)
+    if existing is not None:
+        discard_upload(upload)
+        return KnowledgeBaseDoc(**existing)
     try:
-        doc = ingest_document(file.filename, file_path)
+        doc = await ingest_file(upload.filename, keep_upload(upload), tenant_id, upload.sha256)
     except RuntimeError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     return KnowledgeBaseDoc(**doc)
 
 
+@router.post("/knowledge-base/bulk-upload", response_model=IngestJobView, dependencies=[Depends(require_admin_key)])
+async def bulk_upload_kb(
+    files: List[UploadFile] = File(...),
+    tenant_id: str = Depends(get_tenant_id),
+) -> IngestJobView:
+    root = kb_root(tenant_id)
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(await save_upload(file, root, settings.kb_max_upload_mb * 1024 * 1024))
+    except UploadTooLarge as exc:
+        for upload in uploads:
+            discard_upload(upload)
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    saved = []
+    duplicates = []
+    seen = set()
+    for upload in uploads:
+        existing = await asyncio.to_thread(find_document_by_hash, upload.sha256, tenant_id)
+        if existing is not None or upload.sha256 in seen:
+            discard_upload(upload)
+            duplicates.append((upload.filename, existing))
+            continue
+        seen.add(upload.sha256)
+        saved.append((upload.filename, keep_upload(upload), upload.sha256))
+    return IngestJobView(**start_ingest_job(saved, tenant_id, duplicates))
+
+
+@router.get("/knowledge-base/jobs/{job_id}", response_model=IngestJobView, dependencies=[Depends(require_admin_key)])
+async def kb_ingest_job(job_id: str, tenant_id: str = Depends(get_tenant_id)) -> IngestJobView:
+    job = get_ingest_job(job_id, tenant_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return IngestJobView(**job)
+
+
 @router.get("/knowledge-base", response_model=List[KnowledgeBaseDoc], dependencies=[Depends(require_admin_key)])
-async def list_kb() -> List[KnowledgeBaseDoc]:
-    return [KnowledgeBaseDoc(**doc) for doc in list_documents()]
+async def list_kb(tenant_id: str = Depends(get_tenant_id)) -> List[KnowledgeBaseDoc]:
+    return [KnowledgeBaseDoc(**doc) for doc in await asyncio.to_thread(list_documents, tenant_id)]
 
 
 @router.delete("/knowledge-base/{doc_id}", dependencies=[Depends(require_admin_key)])
-async def delete_kb(doc_id: str) -> Dict[str, str]:
-    delete_document(doc_id)
+async def delete_kb(doc_id: str, tenant_id: str = Depends(get_tenant_id)) -> Dict[str, str]:
+    try:
+        await asyncio.to_thread(delete_document, doc_id, tenant_id)
+    except ServiceUnavailable as exc:
+        raise HTTPException(status_code=503, detail="Retrieval service is unavailable") from exc
     return {"status": "deleted"}
 
 
 @router.post("/knowledge-base/search", response_model=KnowledgeBaseSearchResponse, dependencies=[Depends(require_admin_key)])
-async def search_kb(payload: KnowledgeBaseSearchRequest) -> KnowledgeBaseSearchResponse:
-    context = retrieve_context(payload.query)
-    results = [chunk for chunk in context.split("\n\n") if chunk]
+async def search_kb(
+    payload: KnowledgeBaseSearchRequest,
+    tenant_id: str = Depends(get_tenant_id),
+) -> KnowledgeBaseSearchResponse:
+    results = await asyncio.to_thread(search_knowledge_base, payload.query, tenant_id)
     return KnowledgeBaseSearchResponse(results=results)
 
 
+@router.get("/knowledge-base/cache", dependencies=[Depends(require_admin_key)])
+async def kb_cache_stats() -> Dict[str, Any]:
+    return await asyncio.to_thread(retrieval_cache_stats)
+
+
 @router.get("/bot/config", response_model=BotConfigView, dependencies=[Depends(require_admin_key)])
 async def get_bot_config() -> BotConfigView:
     return BotConfigView(
@@ -301,6 +366,26 @@ async def update_bot_config(payload: BotConfigUpdate, tenant_id: str = Depends(g
     return await get_bot_config()
 
 
+@router.get("/bot/prompt-usage", dependencies=[Depends(require_admin_key)])
+async def bot_prompt_usage() -> Dict[str, Any]:
+    return prompt_usage_stats()
+
+
+@router.get("/bot/reply-paths", dependencies=[Depends(require_admin_key)])
+async def bot_reply_paths() -> Dict[str, Any]:
+    return reply_path_stats()
+
+
+@router.get("/bot/llm-pool", dependencies=[Depends(require_admin_key)])
+async def bot_llm_pool() -> Dict[str, Any]:
+    return llm_pool_stats()
+
+
+@router.get("/bot/response-cache", dependencies=[Depends(require_admin_key)])
+async def bot_response_cache() -> Dict[str, Any]:
+    return get_response_cache().stats()
+
+
 @router.get("/workflows", response_model=List[WorkflowRule], dependencies=[Depends(require_admin_key)])
 async def get_workflows() -> List[WorkflowRule]:
     return [WorkflowRule(**rule) for rule in list_rules()]
@@ -340,12 +425,12 @@ async def export_reports(report_type: str = Query("leads"), tenant_id: str = Dep
 
 
 @router.post("/testing/simulate", response_model=SimulationResponse, dependencies=[Depends(require_admin_key)])
-async def simulate(payload: SimulationRequest) -> SimulationResponse:
+async def simulate(payload: SimulationRequest, tenant_id: str = Depends(get_tenant_id)) -> SimulationResponse:
     history: List[Dict[str, str]] = []
     current = payload.prompt
     transcript: List[Dict[str, str]] = []
     for _ in range(max(payload.turns, 1)):
-        reply, _ = await generate_reply(current, channel="simulator", history=history)
+        reply, _ = await generate_reply(current, channel="simulator", history=history, tenant_id=tenant_id)
         transcript.append({"role": "user", "content": current})
         transcript.append({"role": "assistant", "content": reply})
         history.append({"role": "user", "content": current})
@@ -355,9 +440,13 @@ async def simulate(payload: SimulationRequest) -> SimulationResponse:
 
 
 @router.post("/testing/ab", response_model=ABTestResponse, dependencies=[Depends(require_admin_key)])
-async def ab_test(payload: ABTestRequest) -> ABTestResponse:
-    reply_a, _ = await generate_reply(payload.message, channel="ab-test", history=[{"role": "system", "content": payload.prompt_a}])
-    reply_b, _ = await generate_reply(payload.message, channel="ab-test", history=[{"role": "system", "content": payload.prompt_b}])
+async def ab_test(payload: ABTestRequest, tenant_id: str = Depends(get_tenant_id)) -> ABTestResponse:
+    reply_a, _ = await generate_reply(
+        payload.message, channel="ab-test", history=[{"role": "system", "content": payload.prompt_a}], tenant_id=tenant_id
+    )
+    reply_b, _ = await generate_reply(
+        payload.message, channel="ab-test", history=[{"role": "system", "content": payload.prompt_b}], tenant_id=tenant_id
+    )
     return ABTestResponse(response_a=reply_a, response_b=reply_b)
 
 
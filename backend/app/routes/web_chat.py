@@ -1,11 +1,45 @@
+import json
+from typing import AsyncIterator
+
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
 from app.models.schemas import ChatRequest, ChatResponse
-from app.services.chat_handler import handle_incoming_message
+from app.services.chat_handler import handle_incoming_message, stream_incoming_message
+from app.utils.logger import get_logger
 
 router = APIRouter()
+logger = get_logger()
 
 @router.post("/message", response_model=ChatResponse)
 async def handle_message(payload: ChatRequest) -> ChatResponse:
     user_id = payload.user_id or "web-anon"
     reply = await handle_incoming_message("webchat", user_id, payload.message)
     return ChatResponse(reply=reply)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _reply_events(user_id: str, message: str) -> AsyncIterator[str]:
+    parts = []
+    try:
+        async for delta in stream_incoming_message("webchat", user_id, message):
+            parts.append(delta)
+            yield _sse("token", {"delta": delta})
+    except Exception as exc:
+        logger.warning("Web chat stream failed: %s", exc)
+        yield _sse("error", {"detail": "Reply failed"})
+        return
+    yield _sse("done", {"reply": "".join(parts)})
+
+
+@router.post("/stream")
+async def stream_message(payload: ChatRequest) -> StreamingResponse:
+    user_id = payload.user_id or "web-anon"
+    return StreamingResponse(
+        _reply_events(user_id, payload.message),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
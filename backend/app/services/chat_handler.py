@@ -1,6 +1,8 @@
-from typing import Optional
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set
 
-from app.ai.chatbot import generate_reply
+from app.ai.chatbot import extract_lead, generate_reply, record_stream, stream_reply, summarize_conversation
 from app.config import settings
 from app.services.crm import create_lead as send_crm_lead
 from app.services.sheets import append_row as send_sheet_lead
@@ -9,7 +11,8 @@ from app.services.db import (
     create_lead,
     get_or_create_conversation,
     get_or_create_user,
-    get_recent_messages,
+    get_unsummarized_messages,
+    update_conversation_summary,
 )
 from app.services.workflows import match_rules
 from app.services.intelligence import classify_intent, extract_entities
@@ -18,24 +21,142 @@ from app.utils.logger import get_logger
 
 logger = get_logger()
 
-async def handle_incoming_message(
+HANDOFF_REPLY = "Thanks for reaching out. A human agent will respond shortly."
+
+SUMMARY_BACKLOG = 40
+
+_background_tasks: Set[asyncio.Task] = set()
+_summarizing: Set[int] = set()
+
+
+async def _save_lead(
+    channel: str,
+    lead: Dict[str, Optional[str]],
+    conversation_id: int,
+    tenant_id: str,
+) -> None:
+    created = await create_lead(
+        platform=channel,
+        intent=lead.get("intent"),
+        name=lead.get("name"),
+        phone=lead.get("phone"),
+        email=lead.get("email"),
+        conversation_id=conversation_id,
+        tenant_id=tenant_id,
+    )
+    lead_payload = {
+        "id": created.id,
+        "platform": created.platform,
+        "name": created.name,
+        "phone": created.phone,
+        "email": created.email,
+        "intent": created.intent,
+        "conversation_id": created.conversation_id,
+        "created_at": created.created_at.isoformat(),
+    }
+    logger.info("Lead captured: %s", lead_payload)
+    await send_crm_lead(lead_payload)
+    await send_sheet_lead(lead_payload)
+
+
+async def _capture_lead(
     channel: str,
-    external_user_id: str,
     text: str,
-) -> str:
+    lead: Optional[Dict[str, Optional[str]]],
+    conversation_id: int,
+    tenant_id: str,
+) -> None:
+    try:
+        if lead is None:
+            lead = await extract_lead(text)
+        if lead:
+            await _save_lead(channel, lead, conversation_id, tenant_id)
+    except Exception as exc:
+        logger.warning("Lead capture failed for conversation %s: %s", conversation_id, exc)
+
+
+async def _refresh_summary(
+    conversation_id: int,
+    summary: Optional[str],
+    summary_message_id: Optional[int],
+    aged: List[Dict[str, object]],
+) -> None:
+    if conversation_id in _summarizing:
+        return
+    _summarizing.add(conversation_id)
+    try:
+        messages = [{"role": str(row["role"]), "content": str(row["content"])} for row in aged]
+        updated = await summarize_conversation(summary, messages)
+        await update_conversation_summary(conversation_id, updated, int(aged[-1]["id"]), summary_message_id)
+    except Exception as exc:
+        logger.warning("Summary update failed for conversation %s: %s", conversation_id, exc)
+    finally:
+        _summarizing.discard(conversation_id)
+
+
+def _schedule(coroutine) -> None:
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _schedule_lead_capture(
+    channel: str,
+    text: str,
+    lead: Optional[Dict[str, Optional[str]]],
+    conversation_id: int,
+    tenant_id: str,
+) -> None:
+    _schedule(_capture_lead(channel, text, lead, conversation_id, tenant_id))
+
+
+async def _start_turn(channel: str, external_user_id: str, text: str):
     tenant_id = settings.default_tenant_id
     user = await get_or_create_user(platform=channel, external_id=external_user_id, tenant_id=tenant_id)
     conversation = await get_or_create_conversation(platform=channel, user_id=user.id, tenant_id=tenant_id)
-    history = await get_recent_messages(conversation.id, limit=10, tenant_id=tenant_id)
+    rows = await get_unsummarized_messages(
+        conversation.id,
+        conversation.summary_message_id,
+        limit=settings.ai_history_messages + SUMMARY_BACKLOG,
+        tenant_id=tenant_id,
+    )
+    split = max(len(rows) - max(settings.ai_history_messages, 0), 0)
+    aged = rows[:split]
+    # Aged rows stay in the prompt until the summary has folded them in; fit_history trims to budget.
+    history = [{"role": row["role"], "content": row["content"]} for row in rows]
 
     await add_message(conversation.id, sender="user", content=text, tenant_id=tenant_id)
+    if len(aged) >= max(settings.ai_summary_batch, 1):
+        _schedule(_refresh_summary(conversation.id, conversation.summary, conversation.summary_message_id, aged))
+    return tenant_id, conversation, history
 
-    if conversation.handoff_enabled:
-        return "Thanks for reaching out. A human agent will respond shortly."
 
+def _action_reply(text: str) -> Optional[str]:
     intent_data = classify_intent(text)
     entities = extract_entities(text)
-    action_reply = handle_intent_action(intent_data["intent"], entities, text)
+    return handle_intent_action(intent_data["intent"], entities, text)
+
+
+def _apply_rules(text: str, reply: str) -> str:
+    rules = match_rules(text)
+    for rule in rules:
+        action = rule.get("action", "")
+        if action.startswith("auto_reply:"):
+            reply = action.replace("auto_reply:", "", 1).strip() or reply
+    return reply
+
+
+async def handle_incoming_message(
+    channel: str,
+    external_user_id: str,
+    text: str,
+) -> str:
+    tenant_id, conversation, history = await _start_turn(channel, external_user_id, text)
+
+    if conversation.handoff_enabled:
+        return HANDOFF_REPLY
+
+    action_reply = _action_reply(text)
 
     if action_reply:
         reply, lead = action_reply, None
@@ -44,38 +165,51 @@ async def handle_incoming_message(
             message=text,
             channel=channel,
             history=history,
+            tenant_id=tenant_id,
+            with_lead=False,
+            summary=conversation.summary,
+            conversation_id=conversation.id,
         )
 
-    rules = match_rules(text)
-    for rule in rules:
-        action = rule.get("action", "")
-        if action.startswith("auto_reply:"):
-            reply = action.replace("auto_reply:", "", 1).strip() or reply
+    reply = _apply_rules(text, reply)
 
     await add_message(conversation.id, sender="bot", content=reply, tenant_id=tenant_id)
 
-    if lead:
-        created = await create_lead(
-            platform=channel,
-            intent=lead.get("intent"),
-            name=lead.get("name"),
-            phone=lead.get("phone"),
-            email=lead.get("email"),
-            conversation_id=conversation.id,
-            tenant_id=tenant_id,
-        )
-        lead_payload = {
-            "id": created.id,
-            "platform": created.platform,
-            "name": created.name,
-            "phone": created.phone,
-            "email": created.email,
-            "intent": created.intent,
-            "conversation_id": created.conversation_id,
-            "created_at": created.created_at.isoformat(),
-        }
-        logger.info("Lead captured: %s", lead_payload)
-        await send_crm_lead(lead_payload)
-        await send_sheet_lead(lead_payload)
+    if not action_reply:
+        _schedule_lead_capture(channel, text, lead, conversation.id, tenant_id)
 
     return reply
+
+
+async def stream_incoming_message(
+    channel: str,
+    external_user_id: str,
+    text: str,
+) -> AsyncIterator[str]:
+    started = time.perf_counter()
+    tenant_id, conversation, history = await _start_turn(channel, external_user_id, text)
+
+    if conversation.handoff_enabled:
+        yield HANDOFF_REPLY
+        return
+
+    action_reply = _action_reply(text)
+    override = _apply_rules(text, "")
+    if action_reply or override:
+        reply = override or action_reply
+        yield reply
+    else:
+        parts: List[str] = []
+        first_token = None
+        async for delta in stream_reply(text, channel, history, tenant_id, conversation.summary, conversation.id):
+            if first_token is None:
+                first_token = time.perf_counter()
+            parts.append(delta)
+            yield delta
+        record_stream(started, first_token)
+        reply = "".join(parts)
+
+    await add_message(conversation.id, sender="bot", content=reply, tenant_id=tenant_id)
+
+    if not action_reply:
+        _schedule_lead_capture(channel, text, None, conversation.id, tenant_id)
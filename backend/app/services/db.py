@@ -212,6 +212,52 @@ async def get_recent_messages(conversation_id: int, limit: int = 10, tenant_id:
         rows.reverse()
         return [{"role": "assistant" if row.sender == "bot" else "user", "content": row.content} for row in rows]
 
+async def get_unsummarized_messages(
+    conversation_id: int,
+    after_id: Optional[int],
+    limit: int = 50,
+    tenant_id: str = "default",
+) -> List[Dict[str, object]]:
+    sessionmaker = get_sessionmaker()
+    async with sessionmaker() as session:
+        stmt = (
+            select(Message.id, Message.sender, Message.content)
+            .where(Message.conversation_id == conversation_id, Message.tenant_id == tenant_id)
+            .order_by(Message.id.desc())
+            .limit(limit)
+        )
+        if after_id is not None:
+            stmt = stmt.where(Message.id > after_id)
+        result = await session.execute(stmt)
+        rows = list(result)
+        rows.reverse()
+        return [
+            {"id": row.id, "role": "assistant" if row.sender == "bot" else "user", "content": row.content}
+            for row in rows
+        ]
+
+async def update_conversation_summary(
+    conversation_id: int,
+    summary: str,
+    message_id: int,
+    previous_message_id: Optional[int],
+) -> bool:
+    sessionmaker = get_sessionmaker()
+    async with sessionmaker() as session:
+        # Only advance from the state the summary was built on, so concurrent workers never fold twice.
+        current = (
+            Conversation.summary_message_id.is_(None)
+            if previous_message_id is None
+            else Conversation.summary_message_id == previous_message_id
+        )
+        result = await session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, current)
+            .values(summary=summary, summary_message_id=message_id)
+        )
+        await session.commit()
+        return result.rowcount > 0
+
 async def create_lead(
     platform: str,
     intent: Optional[str],
@@ -0,0 +1,178 @@
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.ai.rag import build_document, find_document_by_hash, index_document, kb_root
+from app.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger()
+
+MAX_TRACKED_JOBS = 100
+
+_executor: Optional[ProcessPoolExecutor] = None
+_jobs: Dict[str, "IngestJob"] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+@dataclass
+class IngestFile:
+    filename: str
+    file_path: str
+    tenant_id: Optional[str] = None
+    sha256: Optional[str] = None
+    status: str = "queued"
+    document: Optional[dict] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class IngestJob:
+    id: str
+    files: List[IngestFile]
+    tenant_id: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    @property
+    def status(self) -> str:
+        if self.finished_at is None:
+            return "running" if any(item.status not in {"queued", "duplicate"} for item in self.files) else "queued"
+        return "failed" if all(item.status == "failed" for item in self.files) else "completed"
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "total": len(self.files),
+            "completed": sum(item.status == "completed" for item in self.files),
+            "failed": sum(item.status == "failed" for item in self.files),
+            "duplicates": sum(item.status == "duplicate" for item in self.files),
+            "files": [
+                {
+                    "filename": item.filename,
+                    "status": item.status,
+                    "document": item.document,
+                    "error": item.error,
+                }
+                for item in self.files
+            ],
+        }
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max(settings.kb_ingest_workers, 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def _replace_broken_executor(broken: ProcessPoolExecutor) -> None:
+    global _executor
+    if _executor is broken:
+        _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def ingest_file(
+    filename: str,
+    file_path: str,
+    tenant_id: Optional[str] = None,
+    sha256: Optional[str] = None,
+) -> dict:
+    if sha256:
+        existing = await asyncio.to_thread(find_document_by_hash, sha256, tenant_id)
+        if existing is not None:
+            return existing
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    try:
+        document = await loop.run_in_executor(
+            executor, build_document, kb_root(tenant_id), filename, file_path, sha256
+        )
+    except BaseException as exc:
+        # Nothing references the kept file until build_document commits it.
+        with suppress(OSError):
+            os.remove(file_path)
+        if isinstance(exc, BrokenProcessPool):
+            # A worker died (OOM, a crashing OCR binary); later uploads get a fresh pool.
+            _replace_broken_executor(executor)
+            raise RuntimeError(f"{filename} could not be processed: the ingest worker crashed") from exc
+        raise
+    if not document["duplicate"]:
+        await asyncio.to_thread(index_document, document["id"], tenant_id)
+    return document
+
+
+async def _process(item: IngestFile) -> None:
+    item.status = "processing"
+    try:
+        item.document = await ingest_file(item.filename, item.file_path, item.tenant_id, item.sha256)
+        item.status = "duplicate" if item.document["duplicate"] else "completed"
+    except Exception as exc:
+        item.status = "failed"
+        item.error = str(exc)
+        logger.warning("Knowledge base ingest failed for %s: %s", item.filename, exc)
+
+
+async def _run_job(job: IngestJob) -> None:
+    try:
+        await asyncio.gather(*(_process(item) for item in job.files if item.status == "queued"))
+    finally:
+        job.finished_at = datetime.utcnow()
+        _tasks.pop(job.id, None)
+
+
+def _prune_jobs() -> None:
+    finished = sorted(
+        (job for job in _jobs.values() if job.finished_at is not None),
+        key=lambda job: job.finished_at,
+    )
+    while len(_jobs) >= MAX_TRACKED_JOBS and finished:
+        _jobs.pop(finished.pop(0).id, None)
+
+
+def start_ingest_job(
+    files: List[Tuple[str, str, Optional[str]]],
+    tenant_id: Optional[str] = None,
+    duplicates: Optional[List[Tuple[str, Optional[dict]]]] = None,
+) -> dict:
+    _prune_jobs()
+    items = [
+        IngestFile(filename=filename, file_path=file_path, tenant_id=tenant_id, sha256=sha256)
+        for filename, file_path, sha256 in files
+    ]
+    items.extend(
+        IngestFile(filename=filename, file_path="", tenant_id=tenant_id, status="duplicate", document=document)
+        for filename, document in duplicates or []
+    )
+    job = IngestJob(id=uuid.uuid4().hex, files=items, tenant_id=tenant_id)
+    _jobs[job.id] = job
+    _tasks[job.id] = asyncio.create_task(_run_job(job))
+    return job.as_dict()
+
+
+def get_ingest_job(job_id: str, tenant_id: Optional[str] = None) -> Optional[dict]:
+    job = _jobs.get(job_id)
+    if job is None or job.tenant_id != tenant_id:
+        return None
+    return job.as_dict()
+
+
+def shutdown_ingest_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
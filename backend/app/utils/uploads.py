@@ -0,0 +1,71 @@
+import hashlib
+import os
+import uuid
+from typing import NamedTuple, Optional
+
+from fastapi import UploadFile
+
+UPLOAD_BLOCK_SIZE = 1 << 20
+# Room for multipart boundaries and part headers on top of the file bytes.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class StoredUpload(NamedTuple):
+    filename: str
+    path: str
+    sha256: str
+    size: int
+
+
+async def save_upload(file: UploadFile, directory: str, max_bytes: int) -> StoredUpload:
+    filename = os.path.basename(file.filename or "") or "upload"
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as handle:
+            while True:
+                block = await file.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes > 0 and size > max_bytes:
+                    raise UploadTooLarge(f"{filename} exceeds the {max_bytes} byte upload limit")
+                digest.update(block)
+                handle.write(block)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return StoredUpload(filename, tmp_path, digest.hexdigest(), size)
+
+
+def request_limit_status(content_length: Optional[str], max_bytes: int) -> Optional[int]:
+    # Checked before the form is parsed: by then Starlette has already spooled the whole body.
+    if max_bytes <= 0:
+        return None
+    if content_length is None:
+        return 411
+    try:
+        length = int(content_length)
+    except ValueError:
+        return 400
+    return 413 if length > max_bytes + MULTIPART_OVERHEAD else None
+
+
+def keep_upload(upload: StoredUpload) -> str:
+    # Named by content so same-named uploads never overwrite each other; the display name travels separately.
+    path = os.path.join(os.path.dirname(upload.path), f"{upload.sha256}-{upload.filename}")
+    os.replace(upload.path, path)
+    return path
+
+
+def discard_upload(upload: StoredUpload) -> None:
+    try:
+        os.remove(upload.path)
+    except OSError:
+        pass
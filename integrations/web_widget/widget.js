@@ -9,14 +9,20 @@ function addMessage(role, text) {
   row.textContent = text;
   messages.appendChild(row);
   messages.scrollTop = messages.scrollHeight;
+  return row;
 }
 
-send.addEventListener("click", async () => {
-  const text = input.value.trim();
-  if (!text) return;
-  input.value = "";
-  addMessage("user", text);
+function parseEvent(block) {
+  let event = "message";
+  const data = [];
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) event = line.slice(6).trim();
+    else if (line.startsWith("data:")) data.push(line.slice(5).trim());
+  }
+  return { event, data: data.length ? JSON.parse(data.join("\n")) : {} };
+}
 
+async function sendOnce(text) {
   const res = await fetch(`${API_BASE}/webchat/message`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
@@ -24,4 +30,56 @@ send.addEventListener("click", async () => {
   });
   const data = await res.json();
   addMessage("bot", data.reply || "No reply");
+}
+
+async function sendStreaming(text) {
+  let res;
+  try {
+    res = await fetch(`${API_BASE}/webchat/stream`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+      body: JSON.stringify({ message: text, user_id: "web-widget" })
+    });
+  } catch (err) {
+    return false;
+  }
+  if (!res.ok || !res.body) return false;
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  const bubble = addMessage("bot", "");
+  let buffer = "";
+  for (;;) {
+    // Once the server has accepted the message, never re-post it: a retry would store it twice.
+    let chunk;
+    try {
+      chunk = await reader.read();
+    } catch (err) {
+      bubble.textContent = bubble.textContent || "Something went wrong, please try again.";
+      break;
+    }
+    const { value, done } = chunk;
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const { event, data } = parseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      if (event === "token") bubble.textContent += data.delta;
+      else if (event === "done") bubble.textContent = data.reply || bubble.textContent || "No reply";
+      else if (event === "error") bubble.textContent = bubble.textContent || "Something went wrong, please try again.";
+      messages.scrollTop = messages.scrollHeight;
+    }
+  }
+  return true;
+}
+
+send.addEventListener("click", async () => {
+  const text = input.value.trim();
+  if (!text) return;
+  input.value = "";
+  addMessage("user", text);
+
+  const streamed = await sendStreaming(text);
+  if (!streamed) await sendOnce(text);
 });